@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the time required by import py_sonicvisualiser in a fresh
+interpreter. Fails if the median import time exceeds the budget, or if
+heavy modules which should only be imported when needed are loaded.
+
+usage: python benchmarks/bench_import.py [budget_seconds] [repeat]
+"""
+
+import subprocess
+import sys
+
+
+# modules which must not be imported by import py_sonicvisualiser
+HEAVY = ['numpy', 'scipy', 'xml.sax', 'xml.dom.minidom', 'wave', 'multiprocessing', 'mmap', 'sqlite3']
+
+PROBE = """
+import sys, time
+t = time.time()
+import py_sonicvisualiser
+t = time.time() - t
+print('%%f %%s' %% (t, ','.join([m for m in %r if m in sys.modules])))
+""" % HEAVY
+
+
+if __name__ == '__main__':
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else 0.1
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    times = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', PROBE]).split()
+        times.append(float(out[0]))
+        if len(out) > 1:
+            sys.exit('heavy modules imported: %s' % out[1])
+    times.sort()
+    median = times[len(times) // 2]
+    print('import py_sonicvisualiser: median %.1f ms, min %.1f ms, budget %.1f ms'
+          % (1000 * median, 1000 * times[0], 1000 * budget))
+    if median > budget:
+        sys.exit('import time budget exceeded')
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of SVEnv.save throughput, with a single BZ2File stream,
+with parallel multi-stream compression, and of incremental saves
+
+usage: python benchmarks/bench_save.py [npoints] [nworkers]
+"""
+
+import os
+import sys
+import time
+import tempfile
+import multiprocessing
+import numpy as np
+from py_sonicvisualiser import SVEnv
+from py_sonicvisualiser.SVBz2 import BZ2Reader
+
+
+if __name__ == '__main__':
+    npoints = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    nworkers = int(sys.argv[2]) if len(sys.argv) > 2 else multiprocessing.cpu_count()
+
+    sve = SVEnv(16000, 16000 * 3600, 'bench.wav')
+    x = np.arange(npoints) * 0.01
+    sve.add_continuous_annotations(x, np.sin(x))
+
+    tmpdir = tempfile.mkdtemp()
+    results = []
+    for name, kwargs in [('BZ2File', {}), ('parallel, %d workers' % nworkers, {'nworkers': nworkers})]:
+        fname = os.path.join(tmpdir, 'bench.sv')
+        t = time.time()
+        sve.save(fname, **kwargs)
+        t = time.time() - t
+        f = BZ2Reader(fname)
+        content = f.read()
+        f.close()
+        results.append(content)
+        print('%s: %.2f s, %.1f MB/s of xml, %d bytes' % (name, t, len(content) / t / 1e6, os.path.getsize(fname)))
+        os.remove(fname)
+    assert results[0] == results[1], 'decompressed contents differ'
+
+    # incremental saves: only the modified dataset is compressed again
+    fname = os.path.join(tmpdir, 'bench.sv')
+    for name in ['incremental, first save', 'incremental, new layer']:
+        t = time.time()
+        sve.save(fname, incremental=True)
+        print('%s: %.2f s' % (name, time.time() - t))
+        sve.add_continuous_annotations(x[:1000], np.cos(x[:1000]))
+    os.remove(fname)
+    os.rmdir(tmpdir)
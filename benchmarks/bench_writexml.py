@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the dataset xml serialization (points/second)
+
+Compares the per-point serialization loop used before the introduction of
+the chunked serializer with SVDataset2D/SVDataset3D.writexml, and checks
+both produce the same bytes.
+
+usage: python benchmarks/bench_writexml.py [npoints]
+"""
+
+import sys
+import time
+import numpy as np
+from py_sonicvisualiser.SVDataset import SVDataset2D, SVDataset3D
+
+
+class CountingWriter:
+    """
+    Writer keeping the written strings, counting the calls to write
+    """
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, s):
+        self.chunks.append(s)
+
+    def getvalue(self):
+        return ''.join(self.chunks)
+
+
+def legacy_writexml(ds, writer, indent="", addindent="", newl=""):
+    writer.write('%s<dataset id="%s" dimensions="%s">%s' % (indent, ds.datasetid, ds.dimensions, newl))
+    indent2 = indent + addindent
+    if ds.dimensions == 2:
+        for l, x, y in zip(ds.labels, ds.frames, ds.values):
+            writer.write('%s<point label="%s" frame="%d" value="%f"/>%s' % (indent2, ds.int2label[l], x, y, newl))
+    else:
+        for l, x, y, d in zip(ds.labels, ds.frames, ds.values, ds.durations):
+            writer.write('%s<point label="%s" frame="%d" value="%f" duration="%d"/>%s' % (indent2, ds.int2label[l], x, y, d, newl))
+    writer.write('%s</dataset>%s' % (indent, newl))
+
+
+def bench(name, ds, npoints):
+    results = []
+    for func in [legacy_writexml, lambda ds, *args: ds.writexml(*args)]:
+        w = CountingWriter()
+        t = time.time()
+        func(ds, w, '    ', '  ', '\n')
+        results.append((time.time() - t, len(w.chunks), w.getvalue()))
+    (tbefore, wbefore, before), (tafter, wafter, after) = results
+    assert before == after, 'serializations differ'
+    print('%s: %d points' % (name, npoints))
+    print('  before: %10.0f points/s (%d writes)' % (npoints / tbefore, wbefore))
+    print('  after:  %10.0f points/s (%d writes)' % (npoints / tafter, wafter))
+    print('  speedup: %.1fx' % (tbefore / tafter))
+
+
+if __name__ == '__main__':
+    npoints = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    frames = np.arange(npoints, dtype=np.int64) * 512
+    values = np.random.randn(npoints)
+
+    ds = SVDataset2D(None, '1', 16000)
+    ds.set_data_from_iterable(frames, values)
+    bench('SVDataset2D, single label', ds, npoints)
+
+    labels = np.array(['speech', 'music', 'noise'], dtype=object)[np.random.randint(0, 3, npoints)]
+    ds = SVDataset3D(None, '1', 16000)
+    ds.set_data_from_iterable(frames, values, np.full(npoints, 256), labels)
+    bench('SVDataset3D, 3 labels', ds, npoints)
@@ -0,0 +1,372 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 David Doukhan <david.doukhan@gmail.com>
+
+# This file is part of py_sonicvisualiser.
+
+# py_sonicvisualiser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# py_sonicvisualiser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with TimeSide.  If not, see <http://www.gnu.org/licenses/>.
+
+# Author: David Doukhan <david.doukhan@gmail.com>
+
+
+"""
+Header-only probing of audio files: sample rate and number of frames are
+read from the file headers, without reading the audio samples.
+Probing results may be stored in a persistent ProbeCache.
+"""
+
+import os
+import struct
+import sys
+import threading
+import time
+
+
+# fixed size sample formats: PCM, IEEE float, A-law, mu-law
+_wave_formats = (0x0001, 0x0003, 0x0006, 0x0007)
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+def _read(f, n):
+    data = f.read(n)
+    if len(data) < n:
+        raise ValueError('unexpected end of file')
+    return data
+
+
+# Sony Wave64 GUIDs
+_w64_riff = 'riff\x2e\x91\xcf\x11\xa5\xd6\x28\xdb\x04\xc1\x00\x00'
+_w64_wave = 'wave\xf3\xac\xd3\x11\x8c\xd1\x00\xc0\x4f\x8e\xdb\x8a'
+# suffix of the GUIDs of the chunks whose name is a FOURCC (fmt, data, ...)
+_w64_fourcc_suffix = _w64_wave[4:]
+
+
+def _iter_wave_chunks(f, fname):
+    """
+    Iterate over the chunks of a RIFF/WAVE, RF64/BW64 or Sony Wave64 file.
+    When a chunk is yielded, f is positioned at the beginning of its content.
+    RF64 chunk sizes are read from the ds64 chunk
+
+    Yields:
+      (str, int): chunk FOURCC (None for unknown Wave64 GUIDs) and size
+    """
+    head = _read(f, 12)
+    if head[:4] in ('RIFF', 'RF64', 'BW64') and head[8:] == 'WAVE':
+        sizes = {}
+        while True:
+            ckid, cksize = struct.unpack('<4sI', _read(f, 8))
+            start = f.tell()
+            if ckid == 'ds64':
+                # sizes of the RIFF and data chunks, sample count,
+                # followed by a table of other chunk sizes
+                _, sizes['data'], _, tablelen = struct.unpack('<QQQI', _read(f, 28))
+                for i in xrange(tablelen):
+                    tableid, tablesize = struct.unpack('<4sQ', _read(f, 12))
+                    sizes[tableid] = tablesize
+            elif cksize == 0xFFFFFFFF and head[:4] != 'RIFF':
+                cksize = sizes.get(ckid, cksize)
+            yield ckid, cksize
+            # chunks are word aligned
+            f.seek(start + cksize + (cksize & 1))
+    elif head + _read(f, 4) == _w64_riff:
+        f.seek(24)
+        if _read(f, 16) != _w64_wave:
+            raise ValueError('%s is not a Wave64 file' % fname)
+        while True:
+            guid, cksize = struct.unpack('<16sQ', _read(f, 24))
+            start = f.tell()
+            # sizes include the 24 bytes chunk header
+            yield (guid[:4] if guid[4:] == _w64_fourcc_suffix else None), cksize - 24
+            # chunks are aligned on 8 bytes
+            f.seek(start - 24 + ((cksize + 7) & ~7))
+    else:
+        raise ValueError('%s is not a RIFF/WAVE, RF64 or Wave64 file' % fname)
+
+
+def probe_wave(fname):
+    """
+    Read the sample rate and the number of frames of a RIFF/WAVE, RF64/BW64
+    or Sony Wave64 file from its fmt and data chunks
+
+    Args:
+      fname(str): path to the wave file
+
+    Returns:
+      (int, int): sample rate (Hz) and number of frames
+    """
+    with open(fname, 'rb') as f:
+        filesize = os.fstat(f.fileno()).st_size
+        fmt = None
+        for ckid, cksize in _iter_wave_chunks(f, fname):
+            if ckid == 'fmt ':
+                if cksize < 16:
+                    raise ValueError('invalid fmt chunk in %s' % fname)
+                fmt = struct.unpack('<HHIIHH', _read(f, 16))
+                formattag, _, samplerate, _, blockalign, _ = fmt
+                if formattag == WAVE_FORMAT_EXTENSIBLE and cksize >= 26:
+                    # cbSize, wValidBitsPerSample, dwChannelMask, then the
+                    # format tag as the first two bytes of SubFormat
+                    formattag = struct.unpack('<8xH', _read(f, 10))[0]
+                if formattag not in _wave_formats or blockalign == 0:
+                    raise ValueError('unsupported wave format %#x in %s' % (formattag, fname))
+            elif ckid == 'data':
+                if fmt is None:
+                    raise ValueError('data chunk found before fmt chunk in %s' % fname)
+                # the data chunk of truncated files is shorter than announced,
+                # and RIFF files larger than 4GB have a meaningless data size
+                datasize = filesize - f.tell()
+                if cksize != 0xFFFFFFFF:
+                    datasize = min(cksize, datasize)
+                return samplerate, datasize // blockalign
+
+
+def probe_flac(fname):
+    """
+    Read the sample rate and the number of frames of a FLAC file from its
+    STREAMINFO metadata block
+
+    Args:
+      fname(str): path to the FLAC file
+
+    Returns:
+      (int, int): sample rate (Hz) and number of frames
+    """
+    with open(fname, 'rb') as f:
+        head = _read(f, 4)
+        if head[:3] == 'ID3':
+            # skip an ID3v2 tag: flags, then syncsafe size, then footer
+            flags, size = struct.unpack('>xBI', _read(f, 6))
+            size = (size & 0x7F) | (size & 0x7F00) >> 1 | (size & 0x7F0000) >> 2 | (size & 0x7F000000) >> 3
+            f.seek(10 + size + (10 if flags & 0x10 else 0))
+            head = _read(f, 4)
+        if head != 'fLaC':
+            raise ValueError('%s is not a FLAC file' % fname)
+        # STREAMINFO is the first metadata block
+        blocktype, blocklen = struct.unpack('>B3s', _read(f, 4))
+        if blocktype & 0x7F != 0 or blocklen != '\x00\x00\x22':
+            raise ValueError('STREAMINFO block not found in %s' % fname)
+        # sample rate (20 bits), channels (3), bits per sample (5),
+        # total number of samples (36)
+        info = struct.unpack('>Q', _read(f, 18)[10:])[0]
+        samplerate = info >> 44
+        nframes = info & 0xFFFFFFFFF
+        if nframes == 0:
+            raise ValueError('unknown number of frames in %s' % fname)
+        return samplerate, nframes
+
+
+def _ieee_extended(data):
+    """
+    Convert a big endian 80 bits IEEE 754 extended precision number
+    """
+    exponent, mantissa = struct.unpack('>HQ', data)
+    sign = -1 if exponent & 0x8000 else 1
+    exponent &= 0x7FFF
+    if exponent == 0 and mantissa == 0:
+        return 0.
+    return sign * mantissa * 2. ** (exponent - 16383 - 63)
+
+
+def probe_aiff(fname):
+    """
+    Read the sample rate and the number of frames of an AIFF or AIFF-C file
+    from its COMM chunk
+
+    Args:
+      fname(str): path to the AIFF file
+
+    Returns:
+      (int, int): sample rate (Hz) and number of frames
+    """
+    with open(fname, 'rb') as f:
+        form, _, kind = struct.unpack('>4sI4s', _read(f, 12))
+        if form != 'FORM' or kind not in ('AIFF', 'AIFC'):
+            raise ValueError('%s is not an AIFF file' % fname)
+        while True:
+            ckid, cksize = struct.unpack('>4sI', _read(f, 8))
+            if ckid == 'COMM':
+                # channels, number of frames, sample size, sample rate
+                _, nframes, _, samplerate = struct.unpack('>hIh10s', _read(f, 18))
+                return int(round(_ieee_extended(samplerate))), nframes
+            # chunks are word aligned
+            f.seek(cksize + (cksize & 1), 1)
+
+
+def _ogg_page(data, pos):
+    """
+    Granule position and serial number of the Ogg page starting at pos
+    """
+    return struct.unpack('<qI', data[pos + 6:pos + 18])
+
+
+def probe_ogg(fname):
+    """
+    Read the sample rate of an Ogg Vorbis file from its identification
+    header, and its number of frames from the granule position of the
+    last page of the Vorbis stream
+
+    Args:
+      fname(str): path to the Ogg Vorbis file
+
+    Returns:
+      (int, int): sample rate (Hz) and number of frames
+    """
+    with open(fname, 'rb') as f:
+        filesize = os.fstat(f.fileno()).st_size
+        # first page: header, segment table, then the identification packet
+        head = _read(f, 27)
+        if head[:5] != 'OggS\x00':
+            raise ValueError('%s is not an Ogg file' % fname)
+        _, serial = _ogg_page(head, 0)
+        f.seek(ord(head[26]), 1)
+        packet = _read(f, 16)
+        if packet[:7] != '\x01vorbis':
+            raise ValueError('%s is not an Ogg Vorbis file' % fname)
+        samplerate = struct.unpack('<I', packet[12:16])[0]
+
+        # last page of the stream: pages are at most 65307 bytes long
+        tailsize = 0
+        while tailsize < filesize:
+            tailsize = min(filesize, tailsize + (1 << 16))
+            f.seek(filesize - tailsize)
+            tail = f.read(tailsize)
+            pos = len(tail)
+            while True:
+                pos = tail.rfind('OggS\x00', 0, pos)
+                if pos < 0:
+                    break
+                if pos + 27 > len(tail):
+                    continue
+                granule, pageserial = _ogg_page(tail, pos)
+                # pages where no packet ends have a granule position of -1
+                if pageserial == serial and granule >= 0:
+                    return samplerate, granule
+        raise ValueError('no granule position found in %s' % fname)
+
+
+def probe(fname):
+    """
+    Read the sample rate and the number of frames of an audio file from its
+    headers. Supported formats are wave (RIFF/WAVE, RF64/BW64, Sony
+    Wave64), FLAC, AIFF/AIFF-C and Ogg Vorbis
+
+    Args:
+      fname(str): path to the audio file
+
+    Returns:
+      (int, int): sample rate (Hz) and number of frames
+    """
+    with open(fname, 'rb') as f:
+        head = f.read(16)
+    if head[:4] in ('RIFF', 'RF64', 'BW64') or head == _w64_riff:
+        return probe_wave(fname)
+    if head[:4] == 'fLaC' or head[:3] == 'ID3':
+        return probe_flac(fname)
+    if head[:4] == 'FORM':
+        return probe_aiff(fname)
+    if head[:4] == 'OggS':
+        return probe_ogg(fname)
+    raise ValueError('unsupported audio format: %s' % fname)
+
+
+def _cache_key(path):
+    """
+    Path bound to a sqlite query: sqlite does not accept non ascii byte
+    strings, which are decoded, or stored as blobs if they cannot be
+    """
+    if not isinstance(path, str):
+        return path
+    try:
+        return path.decode(sys.getfilesystemencoding() or 'ascii')
+    except UnicodeDecodeError:
+        return buffer(path)
+
+
+class ProbeCache(object):
+    """
+    Persistent cache of probing results, stored in a sqlite database.
+    Entries are indexed by absolute path, and are valid as long as the
+    size and modification time of the file are unchanged. The least recently
+    used entries are evicted when the number of entries exceeds maxentries.
+    The cache may be shared by several processes and threads.
+
+    Args:
+      fname(str): path to the database file
+      maxentries(int): maximal number of entries
+    """
+    def __init__(self, fname, maxentries=100000):
+        self.fname = fname
+        self.maxentries = maxentries
+        self._local = threading.local()
+
+    def _connect(self):
+        import sqlite3
+        # sqlite connections are not shared with forked processes
+        # nor with other threads
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.db = sqlite3.connect(self.fname, timeout=60, isolation_level=None)
+            try:
+                local.db.execute('PRAGMA journal_mode=WAL')
+            except sqlite3.DatabaseError:
+                # file systems without shared memory support
+                pass
+            local.db.execute('CREATE TABLE IF NOT EXISTS probes (path TEXT PRIMARY KEY, size INTEGER, mtime REAL, samplerate INTEGER, nframes INTEGER, atime REAL)')
+            local.db.execute('CREATE INDEX IF NOT EXISTS probes_atime ON probes (atime)')
+            local.pid = os.getpid()
+        return local.db
+
+    def probe(self, fname):
+        """
+        Cached version of the probe function. Errors of the database, such
+        as a locked or corrupted file, are handled as cache misses
+
+        Args:
+          fname(str): path to the audio file
+
+        Returns:
+          (int, int): sample rate (Hz) and number of frames
+        """
+        import sqlite3
+        path = os.path.abspath(fname)
+        st = os.stat(path)
+        try:
+            db = self._connect()
+            key = _cache_key(path)
+            row = db.execute('SELECT samplerate, nframes FROM probes WHERE path = ? AND size = ? AND mtime = ?',
+                             (key, st.st_size, st.st_mtime)).fetchone()
+            if row is not None:
+                db.execute('UPDATE probes SET atime = ? WHERE path = ?', (time.time(), key))
+                return row
+        except sqlite3.Error:
+            return probe(path)
+        samplerate, nframes = probe(path)
+        try:
+            self._store(db, key, st, samplerate, nframes)
+        except sqlite3.Error:
+            pass
+        return samplerate, nframes
+
+    def _store(self, db, key, st, samplerate, nframes):
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.execute('INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?, ?)',
+                       (key, st.st_size, st.st_mtime, samplerate, nframes, time.time()))
+            excess = db.execute('SELECT COUNT(*) FROM probes').fetchone()[0] - self.maxentries
+            if excess > 0:
+                db.execute('DELETE FROM probes WHERE path IN (SELECT path FROM probes ORDER BY atime LIMIT ?)', (excess,))
+            db.execute('COMMIT')
+        except:
+            db.execute('ROLLBACK')
+            raise
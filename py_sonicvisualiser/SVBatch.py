@@ -0,0 +1,457 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 David Doukhan <david.doukhan@gmail.com>
+
+# This file is part of py_sonicvisualiser.
+
+# py_sonicvisualiser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# py_sonicvisualiser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with TimeSide.  If not, see <http://www.gnu.org/licenses/>.
+
+# Author: David Doukhan <david.doukhan@gmail.com>
+
+
+"""
+Batch generation of sonic visualiser environments.
+
+The environments to be built are described by a manifest, a file
+containing one JSON object per line. Each entry gives the path to the
+media file, the path to the environment to be written, and the paths to
+its annotation files:
+
+  {"media": "a.wav", "output": "a.sv", "f0": "a.f0.csv", "speech": "a.lab"}
+
+Relative paths are relative to the directory of the manifest. If output
+is not set, the environment is written next to the media file.
+
+Every environment is built using the same recipe, a list of layer
+descriptions applied in order (an entry may define its own recipe in its
+"layers" field):
+
+  [{"kind": "spectrogram"},
+   {"kind": "continuous", "source": "f0", "name": "F0", "overlay": true},
+   {"kind": "intervals", "source": "speech", "colourName": "Green"}]
+
+kind is one of spectrogram, continuous or intervals. source is the
+manifest field giving the annotation file of the layer, layers whose
+source is missing from an entry are skipped. overlay displays the layer
+in the view of the previous layer instead of a new view. The other fields
+are passed to SVEnv.add_continuous_annotations or
+SVEnv.add_interval_annotations.
+
+Continuous annotations are read from .npy files storing (time, value)
+rows, or from text files with two columns (comma separated for .csv
+files). Interval annotations are read from text files whose lines
+contain the start time, the end time and the label of an interval,
+separated by tabulations or spaces.
+"""
+
+import collections
+import json
+import os
+import sys
+import time
+from os.path import abspath, basename, dirname, exists, join, samefile, splitext
+
+
+LAYER_KINDS = ('spectrogram', 'continuous', 'intervals')
+
+
+class BatchReport(collections.namedtuple('BatchReport', 'total built skipped failed seconds audio')):
+    """
+    Progress of a batch
+
+    total(int): number of entries of the manifest
+    built(int): number of environments built
+    skipped(int): number of environments already built by a previous run
+    failed(list): (output, error message) pairs
+    seconds(float): elapsed time
+    audio(float): duration (seconds) of the media of the built environments
+    """
+    __slots__ = ()
+
+    @property
+    def files_per_second(self):
+        return self.built / self.seconds if self.seconds > 0 else 0.
+
+    @property
+    def realtime_factor(self):
+        return self.audio / self.seconds if self.seconds > 0 else 0.
+
+    def __str__(self):
+        return '%d/%d built, %d skipped, %d failed, %.1f files/s, %.0fx realtime' % (
+            self.built, self.total, self.skipped, len(self.failed),
+            self.files_per_second, self.realtime_factor)
+
+
+def _check_recipe(recipe):
+    for layer in recipe:
+        if layer.get('kind') not in LAYER_KINDS:
+            raise ValueError('unknown layer kind %r, should be one of %s' % (layer.get('kind'), ', '.join(LAYER_KINDS)))
+        if layer['kind'] != 'spectrogram' and 'source' not in layer:
+            raise ValueError('%s layers require a source field' % layer['kind'])
+
+
+def read_manifest(fname, recipe=()):
+    """
+    Read the entries of a manifest
+
+    Args:
+      fname(str): path to the manifest
+
+    Kwargs:
+      recipe(list): layer descriptions, used to find the fields of the
+        entries storing paths to annotation files
+
+    Returns:
+      list of entries, whose paths are made absolute
+    """
+    root = dirname(abspath(fname))
+    entries = []
+    with open(fname) as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line)
+            except ValueError, e:
+                raise ValueError('%s:%d: %s' % (fname, lineno, e))
+            if 'media' not in entry:
+                raise ValueError('%s:%d: media field is missing' % (fname, lineno))
+            layers = entry.get('layers', recipe)
+            _check_recipe(layers)
+            if 'output' not in entry:
+                entry['output'] = splitext(entry['media'])[0] + '.sv'
+            for key in ['media', 'output'] + [l['source'] for l in layers if 'source' in l]:
+                if key in entry:
+                    entry[key] = join(root, entry[key])
+            entries.append(entry)
+    return entries
+
+
+def load_continuous(fname):
+    """
+    Read continuous annotations
+
+    Args:
+      fname(str): .npy file storing a 2-column array, or text file
+        with 2 columns (comma separated for .csv files)
+
+    Returns:
+      (float64 array, float64 array): times (seconds) and values
+    """
+    import numpy as np
+    if fname.endswith('.npy'):
+        a = np.load(fname)
+    else:
+        a = np.loadtxt(fname, delimiter=',' if fname.endswith('.csv') else None, ndmin=2)
+    if a.ndim != 2 or a.shape[1] != 2:
+        raise ValueError('%s: 2 columns expected, got array of shape %s' % (fname, a.shape))
+    return np.ascontiguousarray(a[:, 0], np.float64), np.ascontiguousarray(a[:, 1], np.float64)
+
+
+def load_intervals(fname):
+    """
+    Read interval annotations
+
+    Args:
+      fname(str): text file whose lines contain the start time, the end
+        time and the optional label of an interval
+
+    Returns:
+      (float64 array, float64 array, list): start times, durations
+        (seconds) and labels
+    """
+    import numpy as np
+    starts = []
+    ends = []
+    labels = []
+    with open(fname) as f:
+        for lineno, line in enumerate(f, 1):
+            fields = line.split(None, 2)
+            if not fields or fields[0].startswith('#'):
+                continue
+            try:
+                starts.append(float(fields[0]))
+                ends.append(float(fields[1]))
+            except (ValueError, IndexError):
+                raise ValueError('%s:%d: start and end times expected' % (fname, lineno))
+            labels.append(fields[2].strip() if len(fields) > 2 else '')
+    starts = np.array(starts, np.float64)
+    return starts, np.array(ends, np.float64) - starts, labels
+
+
+def build_env(entry, recipe=(), samplerate=None, nframes=None, templates=None):
+    """
+    Build the environment of a manifest entry
+
+    Args:
+      entry(dict): manifest entry
+
+    Kwargs:
+      recipe(list): layer descriptions, overriden by the layers field
+        of the entry
+      samplerate(int): media sample rate (Hz), read from the media file
+        if not set
+      nframes(int): number of samples of the media
+      templates(dict): if set, empty environments indexed by layout.
+        The environment of an entry whose layout was already built is
+        instantiated from the template (see SVEnv.instantiate) instead
+        of being built layer by layer
+
+    Returns:
+      SVEnv
+    """
+    from SVEnv import SVEnv
+    layers = entry.get('layers', recipe)
+    present = [layer.get('source') is None or layer['source'] in entry for layer in layers]
+    key = (json.dumps(layers, sort_keys=True), tuple(present))
+    if templates is not None and key in templates:
+        sve = templates[key].instantiate(entry['media'], samplerate, nframes)
+        annotations = [layer for layer, p in zip(layers, present) if p and layer['kind'] != 'spectrogram']
+        for i, layer in enumerate(annotations):
+            if layer['kind'] == 'continuous':
+                sve.set_continuous_annotations(i, *load_continuous(entry[layer['source']]))
+            else:
+                sve.set_interval_annotations(i, *load_intervals(entry[layer['source']]))
+        return sve
+
+    if samplerate is None:
+        sve = SVEnv.init_from_wave_file(entry['media'])
+    else:
+        sve = SVEnv(samplerate, nframes, entry['media'])
+    view = None
+    for layer, p in zip(layers, present):
+        kwargs = dict((str(k), v) for k, v in layer.items())
+        kind = kwargs.pop('kind')
+        source = kwargs.pop('source', None)
+        if not kwargs.pop('overlay', False):
+            view = None
+        if not p:
+            continue
+        if kind == 'spectrogram':
+            view = sve.add_spectrogram(view)
+        elif kind == 'continuous':
+            x, y = load_continuous(entry[source])
+            view = sve.add_continuous_annotations(x, y, view=view, **kwargs)
+        else:
+            starts, durations, labels = load_intervals(entry[source])
+            view = sve.add_interval_annotations(starts, durations, labels, view=view, **kwargs)
+    if templates is not None:
+        templates[key] = sve.instantiate(entry['media'], sve.samplerate, sve.nframes)
+    return sve
+
+
+# templates of the environments built by a worker process
+_templates = {}
+
+
+def _probe_entry(args):
+    i, media, cache = args
+    from SVAudioProbe import probe
+    try:
+        return i, (probe(media) if cache is None else cache.probe(media))
+    except Exception:
+        # decoded by the worker, errors of a shared cache included:
+        # an exception raised here would stop feeding the build pool
+        return i, None
+
+
+def _init_worker(memory_limit):
+    if memory_limit is not None:
+        import resource
+        # shared libraries are mapped before the address space is limited
+        import numpy
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def _build_entry(task):
+    i, entry, recipe, probed, compresslevel, build_cache = task
+    output = entry['output']
+    tmpfname = join(dirname(output), '.%s.%d.tmp' % (basename(output), os.getpid()))
+    try:
+        if not exists(dirname(output)):
+            try:
+                os.makedirs(dirname(output))
+            except OSError:
+                # created by another worker
+                if not exists(dirname(output)):
+                    raise
+        samplerate, nframes = probed if probed is not None else (None, None)
+        sve = build_env(entry, recipe, samplerate, nframes, _templates)
+        sve.save(tmpfname, compresslevel=compresslevel, cache=build_cache)
+        # readers of output never see partially written environments
+        if exists(output) and samefile(tmpfname, output):
+            # both are links to the same build cache entry
+            os.remove(tmpfname)
+        else:
+            os.rename(tmpfname, output)
+        return i, float(sve.nframes) / sve.samplerate, None
+    except Exception, e:
+        if exists(tmpfname):
+            os.remove(tmpfname)
+        return i, 0., '%s: %s' % (type(e).__name__, e)
+
+
+def build(manifest, recipe=(), nworkers=None, probe_threads=8, cache=None, journal=None,
+          maxtasksperchild=64, memory_limit=None, compresslevel=9, progress=None, build_cache=None):
+    """
+    Build the environments described by a manifest on a pool of processes.
+    Media files are probed by a pool of threads, and the environments of
+    probed media are built while the next ones are probed.
+
+    Environments are written to a temporary file renamed when complete.
+    The outputs of the environments built are appended to a journal:
+    environments found in the journal are skipped by the next runs, so
+    that an interrupted batch may be resumed. Failures are reported
+    without interrupting the batch, and retried by the next runs.
+
+    Args:
+      manifest(str or list): path to the manifest, or list of entries
+        whose paths are absolute
+
+    Kwargs:
+      recipe(list): layer descriptions
+      nworkers(int): number of build processes, None uses all the cpus
+      probe_threads(int): number of probing threads
+      cache(ProbeCache or str): persistent cache of the probing results,
+        or path to its database
+      journal(str): path to the journal, default to the manifest path
+        followed by .journal. None disables the journal when the manifest
+        is a list of entries
+      maxtasksperchild(int): number of environments built by a process
+        before it is replaced, releasing its memory
+      memory_limit(int): maximal address space of each process (bytes).
+        Environments requiring more memory fail with a MemoryError
+      compresslevel(int): bzip2 compression level, between 1 and 9
+      progress(callable): called with the current BatchReport each time
+        an environment is completed
+      build_cache(BuildCache or str): build cache, or path to its
+        directory. Environments whose content did not change since they
+        were cached are linked instead of being compressed, see SVEnv.save
+
+    Returns:
+      BatchReport
+    """
+    from multiprocessing import Pool, cpu_count
+    from multiprocessing.pool import ThreadPool
+    from SVAudioProbe import ProbeCache
+
+    t0 = time.time()
+    recipe = list(recipe)
+    _check_recipe(recipe)
+    if isinstance(manifest, basestring):
+        if journal is None:
+            journal = manifest + '.journal'
+        entries = read_manifest(manifest, recipe)
+    else:
+        entries = list(manifest)
+    if isinstance(cache, basestring):
+        cache = ProbeCache(cache)
+
+    done = set()
+    if journal is not None and exists(journal):
+        with open(journal) as f:
+            done.update(line.rstrip('\n') for line in f)
+    todo = [i for i, entry in enumerate(entries) if not (entry['output'] in done and exists(entry['output']))]
+    skipped = len(entries) - len(todo)
+    built = 0
+    failed = []
+    audio = 0.
+
+    def report():
+        return BatchReport(len(entries), built, skipped, failed, time.time() - t0, audio)
+
+    if not todo:
+        return report()
+
+    def tasks(probed):
+        for i, info in probed:
+            yield i, entries[i], recipe, info, compresslevel, build_cache
+
+    fjournal = open(journal, 'a') if journal is not None else None
+    probers = ThreadPool(probe_threads)
+    workers = Pool(nworkers or cpu_count(), _init_worker, (memory_limit,), maxtasksperchild)
+    try:
+        probed = probers.imap_unordered(_probe_entry, [(i, entries[i]['media'], cache) for i in todo])
+        pending = set(todo)
+        for i, duration, error in workers.imap_unordered(_build_entry, tasks(probed)):
+            pending.discard(i)
+            output = entries[i]['output']
+            if error is None:
+                built += 1
+                audio += duration
+                if fjournal is not None:
+                    fjournal.write(output + '\n')
+                    fjournal.flush()
+            else:
+                failed.append((output, error))
+            if progress is not None:
+                progress(report())
+        # entries may not be reported as built nor failed
+        for i in sorted(pending):
+            failed.append((entries[i]['output'], 'not built'))
+        workers.close()
+    except:
+        workers.terminate()
+        raise
+    finally:
+        workers.join()
+        probers.close()
+        probers.join()
+        if fjournal is not None:
+            fjournal.close()
+    return report()
+
+
+def main(argv=None):
+    """
+    Command line interface: python -m py_sonicvisualiser build ...
+    """
+    import argparse
+    parser = argparse.ArgumentParser(prog='python -m py_sonicvisualiser',
+                                     description='Batch generation of sonic visualiser environments')
+    commands = parser.add_subparsers(dest='command')
+    cmd = commands.add_parser('build', help='build the environments described by a manifest')
+    cmd.add_argument('manifest', help='JSON-lines file, one environment per line')
+    cmd.add_argument('-r', '--recipe', help='JSON file storing the list of layers of each environment')
+    cmd.add_argument('-j', '--jobs', type=int, default=None, help='number of build processes (default: number of cpus)')
+    cmd.add_argument('--probe-threads', type=int, default=8, help='number of probing threads (default: 8)')
+    cmd.add_argument('--cache', help='sqlite database caching the probing results')
+    cmd.add_argument('--journal', help='journal of the environments built (default: MANIFEST.journal)')
+    cmd.add_argument('--maxtasksperchild', type=int, default=64, help='environments built by a process before it is replaced (default: 64)')
+    cmd.add_argument('--memory-limit', type=int, default=None, help='address space limit of each process (MB)')
+    cmd.add_argument('-z', '--compresslevel', type=int, default=9, choices=range(1, 10), help='bzip2 compression level (default: 9)')
+    cmd.add_argument('--build-cache', help='directory caching the environments by content')
+    cmd.add_argument('-q', '--quiet', action='store_true', help='do not report progress')
+    args = parser.parse_args(argv)
+
+    recipe = ()
+    if args.recipe is not None:
+        with open(args.recipe) as f:
+            recipe = json.load(f)
+
+    last = [0.]
+    def progress(rep):
+        if rep.seconds - last[0] >= 1.:
+            last[0] = rep.seconds
+            sys.stderr.write('\r' + str(rep))
+            sys.stderr.flush()
+
+    rep = build(args.manifest, recipe, args.jobs, args.probe_threads, args.cache, args.journal,
+                args.maxtasksperchild, None if args.memory_limit is None else args.memory_limit << 20,
+                args.compresslevel, None if args.quiet else progress, args.build_cache)
+    if not args.quiet:
+        sys.stderr.write('\r%s in %.1f s\n' % (rep, rep.seconds))
+    for output, error in rep.failed:
+        sys.stderr.write('%s: %s\n' % (output, error))
+    return 1 if rep.failed else 0
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 David Doukhan <david.doukhan@gmail.com>
+
+# This file is part of py_sonicvisualiser.
+
+# py_sonicvisualiser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# py_sonicvisualiser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with TimeSide.  If not, see <http://www.gnu.org/licenses/>.
+
+# Author: David Doukhan <david.doukhan@gmail.com>
+
+
+"""
+Content-addressed cache of sonic visualiser environment files.
+
+Environments are indexed by a digest of their serialization: the tree of
+models, layers and views (including the main audio model and the layer
+parameters) and the arrays of the datasets. Saving an environment whose
+digest is found in the cache links or copies the cached file instead of
+serializing and compressing the environment.
+"""
+
+import errno
+import hashlib
+import os
+import shutil
+from os.path import basename, dirname, exists, join, samefile
+
+
+class _DigestWriter(object):
+    """
+    Writer updating a hash object with the serialized environment.
+    Datasets update it with their arrays, see SVDataset2D.update_digest
+    """
+    def __init__(self, digest):
+        self.digest = digest
+
+    def write(self, data):
+        self.digest.update(data.encode('utf-8') if isinstance(data, unicode) else data)
+
+
+def _link(src, dst):
+    """
+    Atomically replace dst by a hard link to src, or by a copy of src if
+    hard links are not supported
+    """
+    # renaming a file over a link to the same inode does nothing
+    if exists(dst) and samefile(src, dst):
+        return
+    tmp = join(dirname(dst) or '.', '.%s.%d.tmp' % (basename(dst), os.getpid()))
+    if exists(tmp):
+        os.remove(tmp)
+    try:
+        os.link(src, tmp)
+    except OSError, e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP, errno.EOPNOTSUPP):
+            raise
+        shutil.copyfile(src, tmp)
+    os.rename(tmp, dst)
+
+
+class BuildCache(object):
+    """
+    Directory storing environment files indexed by the digest of their
+    content. The cache may be shared by several processes.
+
+    Cached files may be hard linked to the saved environments: SVEnv.save
+    unlinks a file having several links before overwriting it, so that
+    the cache is not modified.
+
+    Args:
+      dirname(str): path to the cache directory, created if needed
+    """
+
+    # changed when the serialization of environments changes
+    serial = 2
+
+    def __init__(self, dirname):
+        self.dirname = dirname
+
+    def key(self, sve, compresslevel=9):
+        """
+        Digest of an environment
+
+        Args:
+          sve(SVEnv): environment
+
+        Kwargs:
+          compresslevel(int): bzip2 compression level of the file
+
+        Returns:
+          str: hexadecimal digest
+        """
+        h = hashlib.sha1('py_sonicvisualiser %d %d\0' % (self.serial, compresslevel))
+        sve.doc.writexml(_DigestWriter(h), addindent='  ', newl='\n')
+        return h.hexdigest()
+
+    def path(self, key):
+        return join(self.dirname, key[:2], key + '.sv')
+
+    def fetch(self, key, outfname):
+        """
+        Write the cached environment of a digest to outfname
+
+        Returns:
+          bool: False if the digest is not in the cache
+        """
+        path = self.path(key)
+        try:
+            _link(path, outfname)
+        except (IOError, OSError), e:
+            if e.errno != errno.ENOENT or exists(path):
+                raise
+            return False
+        # time of the last use, see prune
+        os.utime(path, None)
+        return True
+
+    def store(self, key, fname):
+        """
+        Add an environment file to the cache
+        """
+        path = self.path(key)
+        if not exists(dirname(path)):
+            try:
+                os.makedirs(dirname(path))
+            except OSError:
+                # created by another process
+                if not exists(dirname(path)):
+                    raise
+        _link(fname, path)
+
+    def prune(self, maxbytes):
+        """
+        Remove the least recently used environments until the size of the
+        cache is lower than maxbytes
+        """
+        entries = []
+        for root, dirs, files in os.walk(self.dirname):
+            for name in files:
+                if name.endswith('.sv'):
+                    path = join(root, name)
+                    st = os.stat(path)
+                    entries.append((st.st_mtime, st.st_size, path))
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= maxbytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # removed by another process
+                pass
+            total -= size
@@ -0,0 +1,424 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 David Doukhan <david.doukhan@gmail.com>
+
+# This file is part of py_sonicvisualiser.
+
+# py_sonicvisualiser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# py_sonicvisualiser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with TimeSide.  If not, see <http://www.gnu.org/licenses/>.
+
+# Author: David Doukhan <david.doukhan@gmail.com>
+
+
+"""
+bzip2 input/output of sonic visualiser environment files
+
+Data may be compressed as independent single block bzip2 streams, in
+parallel or beforehand, and merged into a single bzip2 stream: the
+blocks are concatenated at the bit level and the stream CRC is computed
+from the block CRCs. The files written are thus read by single stream
+decoders, such as BZ2File or sonic visualiser.
+
+BZ2Reader also reads files made of several bzip2 streams, and may
+decompress the streams of such files in parallel.
+"""
+
+import binascii
+import bz2
+import collections
+import itertools
+import re
+
+
+# magic numbers (48 bits) starting the blocks and ending the streams
+_block_magic = 0x314159265359
+_eos_magic = 0x177245385090
+
+
+# stream header followed by a block header, or by the end of an empty stream
+_stream_start = re.compile(r'BZh[1-9](?:1AY&SY|\x17rE8P\x90)')
+
+
+def block_input_size(compresslevel):
+    """
+    Maximal size of the data compressed as a single bzip2 block. Blocks
+    store 100000 * compresslevel - 19 bytes after a run-length encoding
+    expanding data by at most 5/4
+    """
+    return (100000 * compresslevel - 19) * 4 // 5
+
+
+def compress_blocks(data, compresslevel=9):
+    """
+    Compress data as a sequence of single block bzip2 streams, to be
+    merged by a BZ2StreamMerger
+
+    Returns:
+      list of str: bzip2 streams
+    """
+    size = block_input_size(compresslevel)
+    return [bz2.compress(data[i:i + size], compresslevel) for i in xrange(0, len(data), size)]
+
+
+def _parse_block_stream(stream):
+    """
+    Split a bzip2 stream made of a single block (or of no block)
+
+    Returns:
+      (level, bits, nbits, crc): compression level of the header, bits
+      of the block as a long integer and their number, and CRC of the block
+    """
+    if stream[:3] != 'BZh' or not '1' <= stream[3:4] <= '9':
+        raise ValueError('not a bzip2 stream')
+    n = long(binascii.hexlify(stream), 16)
+    total = 8 * len(stream)
+    for pad in xrange(8):
+        # the end of stream marker and the stream CRC are followed by
+        # at most 7 padding bits
+        if (n >> (pad + 32)) & 0xffffffffffff == _eos_magic and not n & ((1 << pad) - 1):
+            nbits = total - pad - 80 - 32
+            crc = (n >> pad) & 0xffffffff
+            if nbits < 0:
+                break
+            bits = (n >> (pad + 80)) & ((1 << nbits) - 1)
+            if nbits and bits >> (nbits - 48) != _block_magic:
+                raise ValueError('bzip2 stream does not start with a block')
+            if nbits and stream[10:14] != binascii.unhexlify('%08x' % crc):
+                # the CRC of a stream is the CRC of its block only if
+                # it has a single block
+                raise ValueError('bzip2 stream made of several blocks')
+            return int(stream[3]), bits, nbits, crc
+    raise ValueError('truncated bzip2 stream')
+
+
+class BZ2StreamMerger(object):
+    """
+    Write a single bzip2 stream to a file object, made of the blocks of
+    single block bzip2 streams (see compress_blocks). The blocks are
+    not decompressed
+
+    Args:
+      f: file object
+      compresslevel(int): compression level of the stream header, at least
+        the level of the merged streams
+    """
+    def __init__(self, f, compresslevel=9):
+        self.f = f
+        self.compresslevel = compresslevel
+        self.crc = 0
+        # bits not written yet, less than 8 between calls
+        self.bits = 0
+        self.nbits = 0
+        f.write('BZh%d' % compresslevel)
+
+    def _write_bits(self, bits, nbits):
+        self.bits = (self.bits << nbits) | bits
+        self.nbits += nbits
+        nbytes = self.nbits // 8
+        if nbytes:
+            rest = self.nbits - 8 * nbytes
+            self.f.write(binascii.unhexlify('%0*x' % (2 * nbytes, self.bits >> rest)))
+            self.bits &= (1 << rest) - 1
+            self.nbits = rest
+
+    def append(self, stream):
+        """
+        Append the block of a single block bzip2 stream
+        """
+        level, bits, nbits, crc = _parse_block_stream(stream)
+        if level > self.compresslevel:
+            raise ValueError('bzip2 stream of level %d merged into a stream of level %d' % (level, self.compresslevel))
+        if nbits:
+            self._write_bits(bits, nbits)
+            self.crc = (((self.crc << 1) | (self.crc >> 31)) & 0xffffffff) ^ crc
+
+    def close(self):
+        """
+        Write the end of the stream. The file object is not closed
+        """
+        self._write_bits((_eos_magic << 32) | self.crc, 80)
+        if self.nbits:
+            self._write_bits(0, 8 - self.nbits)
+
+
+def iter_decompress(f, bufsize=1 << 20):
+    """
+    Decompress the concatenated bzip2 streams of a file object
+
+    Yields:
+      str: decompressed data
+    """
+    dec = bz2.BZ2Decompressor()
+    for data in iter(lambda: f.read(bufsize), ''):
+        while data:
+            try:
+                out = dec.decompress(data)
+            except EOFError:
+                # the previous stream ended exactly at the end of a read
+                dec = bz2.BZ2Decompressor()
+                continue
+            if out:
+                yield out
+            data = dec.unused_data
+            if data:
+                dec = bz2.BZ2Decompressor()
+
+
+def find_streams(fname):
+    """
+    Locate the candidate bzip2 streams of a file, by searching their headers.
+    Candidates are only confirmed by their decompression, since the
+    compressed data may contain a header-like sequence
+
+    Returns:
+      list: (start, end) offsets of the candidate streams
+    """
+    import mmap
+    with open(fname, 'rb') as f:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            return []
+        starts = [match.start() for match in _stream_start.finditer(m)]
+        size = len(m)
+        m.close()
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return zip(starts, starts[1:] + [size])
+
+
+def _decompress_stream(fname, start, end):
+    """
+    Decompress the single bzip2 stream found between offsets start and end
+    """
+    with open(fname, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    dec = bz2.BZ2Decompressor()
+    out = dec.decompress(data)
+    try:
+        dec.decompress('')
+    except EOFError:
+        if not dec.unused_data:
+            return out
+    raise ValueError('not a single bzip2 stream')
+
+
+def iter_decompress_parallel(fname, nworkers=None):
+    """
+    Decompress the concatenated bzip2 streams of a file, the streams being
+    decompressed in parallel by a pool of processes
+
+    Yields:
+      str: decompressed data, one item per stream
+    """
+    import multiprocessing
+    nworkers = nworkers or multiprocessing.cpu_count()
+    streams = iter(find_streams(fname))
+    pool = multiprocessing.Pool(nworkers)
+    pending = collections.deque()
+
+    def submit(stream):
+        pending.append((stream[0], pool.apply_async(_decompress_stream, (fname,) + stream)))
+
+    try:
+        # bound the number of decompressed streams kept in memory
+        for stream in itertools.islice(streams, 2 * nworkers):
+            submit(stream)
+        while pending:
+            start, result = pending.popleft()
+            try:
+                out = result.get()
+            except (ValueError, IOError):
+                # wrong stream boundary: the previous streams were
+                # complete, decompress sequentially from this offset
+                pool.terminate()
+                with open(fname, 'rb') as f:
+                    f.seek(start)
+                    for out in iter_decompress(f):
+                        yield out
+                return
+            stream = next(streams, None)
+            if stream is not None:
+                submit(stream)
+            yield out
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+class BZ2Reader(object):
+    """
+    Read-only file object decompressing the concatenated bzip2 streams of a
+    file (BZ2File only reads the first stream). Seeking backward restarts
+    the decompression from the beginning of the file.
+
+    Args:
+      fname(str): bzip2 file
+      nworkers(int): number of processes used to decompress multi-stream
+        files. If different from 1, the streams are decompressed in
+        parallel. None uses all the cpus. Single stream files are always
+        decompressed sequentially
+    """
+    def __init__(self, fname, nworkers=1):
+        self.fname = fname
+        self.nworkers = nworkers
+        self._open()
+
+    def _open(self):
+        self.f = open(self.fname, 'rb')
+        if self.nworkers != 1 and len(find_streams(self.fname)) > 1:
+            self.blocks = iter_decompress_parallel(self.fname, self.nworkers)
+        else:
+            self.blocks = iter_decompress(self.f)
+        self.buf = ''
+        self.pos = 0
+
+    def read(self, size=-1):
+        chunks = [self.buf]
+        n = len(self.buf)
+        while size < 0 or n < size:
+            block = next(self.blocks, None)
+            if block is None:
+                break
+            chunks.append(block)
+            n += len(block)
+        buf = ''.join(chunks)
+        if size < 0:
+            size = len(buf)
+        self.buf = buf[size:]
+        self.pos += min(size, len(buf))
+        return buf[:size]
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset):
+        if offset < self.pos:
+            self.close()
+            self._open()
+        while self.pos < offset:
+            if not self.read(min(offset - self.pos, 1 << 20)):
+                break
+
+    def close(self):
+        if hasattr(self.blocks, 'close'):
+            self.blocks.close()
+        self.f.close()
+
+
+class ParallelBZ2Writer(object):
+    """
+    Write-only file object splitting the written data into blocks,
+    compressed as independent single block bzip2 streams by a pool of
+    processes, and merged into a single bzip2 stream
+
+    Args:
+      fname(str): output file
+      nworkers(int): number of compression processes, default to the
+        number of cpus
+      compresslevel(int): bzip2 compression level, between 1 and 9
+      blocksize(int): size of the uncompressed blocks, at most (and
+        default to) block_input_size(compresslevel)
+    """
+    def __init__(self, fname, nworkers=None, compresslevel=9, blocksize=None):
+        if blocksize is not None and blocksize > block_input_size(compresslevel):
+            raise ValueError('blocksize larger than a bzip2 block: %d > %d' % (blocksize, block_input_size(compresslevel)))
+        import multiprocessing
+        self.nworkers = nworkers or multiprocessing.cpu_count()
+        self.compresslevel = compresslevel
+        self.blocksize = blocksize or block_input_size(compresslevel)
+        self.f = open(fname, 'wb')
+        self.merger = BZ2StreamMerger(self.f, compresslevel)
+        self.pool = multiprocessing.Pool(self.nworkers)
+        self.pending = collections.deque()
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.chunks.append(data)
+        self.size += len(data)
+        while self.size >= self.blocksize:
+            self._submit()
+
+    def _submit(self):
+        data = ''.join(self.chunks)
+        block, rest = data[:self.blocksize], data[self.blocksize:]
+        self.chunks = [rest] if rest else []
+        self.size = len(rest)
+        self.pending.append(self.pool.apply_async(bz2.compress, (block, self.compresslevel)))
+        # bound the number of blocks kept in memory
+        while len(self.pending) > 2 * self.nworkers:
+            self.merger.append(self.pending.popleft().get())
+
+    def close(self):
+        if self.size > 0:
+            self._submit()
+        while self.pending:
+            self.merger.append(self.pending.popleft().get())
+        self.merger.close()
+        self.pool.close()
+        self.pool.join()
+        self.f.close()
+
+
+class SplicingBZ2Writer(object):
+    """
+    Write-only bzip2 file object allowing to insert data compressed
+    beforehand as single block bzip2 streams (see compress_blocks) between
+    the written data, without decompressing them. The output file is a
+    single bzip2 stream
+
+    Args:
+      fname(str): output file
+      compresslevel(int): bzip2 compression level, between 1 and 9
+    """
+    def __init__(self, fname, compresslevel=9):
+        self.compresslevel = compresslevel
+        self.f = open(fname, 'wb')
+        self.merger = BZ2StreamMerger(self.f, compresslevel)
+        self.chunks = []
+        self.size = 0
+
+    def write(self, data):
+        if isinstance(data, unicode):
+            data = data.encode('utf-8')
+        self.chunks.append(data)
+        self.size += len(data)
+        if self.size >= block_input_size(self.compresslevel):
+            self._flush()
+
+    def _flush(self):
+        for stream in compress_blocks(''.join(self.chunks), self.compresslevel):
+            self.merger.append(stream)
+        self.chunks = []
+        self.size = 0
+
+    def splice(self, streams):
+        """
+        Insert compressed data at the current position
+
+        Args:
+          streams(str iterable): single block bzip2 streams
+        """
+        self._flush()
+        for stream in streams:
+            self.merger.append(stream)
+
+    def close(self):
+        self._flush()
+        self.merger.close()
+        self.f.close()
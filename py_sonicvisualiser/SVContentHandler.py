@@ -20,20 +20,32 @@
 # Author: David Doukhan <david.doukhan@gmail.com>
 
 
+import collections
+import math
 import xml.sax as sax
-import xml.dom.minidom as minidom
+from SVElement import SVDocument
 from SVDataset import SVDataset2D, SVDataset3D
 
 class SVContentHandler(sax.ContentHandler):
     """
-    Goal: clone to dom at the exception of dataset nodes
+    Goal: clone to a SVDocument at the exception of dataset nodes
+
+    Args:
+      window((float, float)): if set, time range (seconds) of the points
+        to be kept. Intervals overlapping the range are kept
     """
-    def __init__(self):
+    # number of point nodes converted at once
+    point_chunksize = 65536
+
+    def __init__(self, window=None):
         sax.ContentHandler.__init__(self)
+        self.window = window
+        # window in frames, set when the sample rate is known
+        self.framewindow = None
         self.datasets = []
-        imp = minidom.getDOMImplementation()
-        dt = imp.createDocumentType('sonic-visualiser', None, None)
-        self.dom = imp.createDocument(None,'sv', dt)
+        # attribute values of the point nodes not yet converted
+        self.points = collections.defaultdict(list)
+        self.dom = SVDocument('sv', 'sonic-visualiser')
         self.curnode = self.dom.documentElement        
         self.nbdata = 0
  
@@ -47,6 +59,9 @@ class SVContentHandler(sax.ContentHandler):
             self.samplerate = int(attrs.getValue('sampleRate'))
             self.nframes = int(attrs.getValue('end'))
             self.mediafile = attrs.getValue('file')
+            if self.window is not None:
+                t0, t1 = self.window
+                self.framewindow = (int(math.ceil(t0 * self.samplerate)), int(math.floor(t1 * self.samplerate)))
 
         if name == 'dataset':
             dim = int(attrs.getValue('dimensions'))
@@ -57,7 +72,11 @@ class SVContentHandler(sax.ContentHandler):
                 self.datasets.append(SVDataset3D(self.dom, dataid, self.samplerate))
             self.curnode = self.curnode.appendChild(self.datasets[-1])
         elif name == 'point':
-            self.datasets[-1].append_xml_point(attrs)
+            if self.framewindow is None or self.inWindow(attrs):
+                for k, v in attrs.items():
+                    self.points[k].append(v)
+                if len(self.points['frame']) >= self.point_chunksize:
+                    self.flushPoints()
         elif name == 'sv':
             pass
         else:
@@ -72,13 +91,30 @@ class SVContentHandler(sax.ContentHandler):
             elif name == 'window':
                 self.defwidth = int(attrs.getValue('width'))
 
-            for at, val in attrs.items():
-                node.setAttribute(at, val)
+            node.attributes.update(attrs.items())
             self.curnode = node
 
+    def inWindow(self, attrs):
+        first, last = self.framewindow
+        frame = int(attrs.getValue('frame'))
+        if attrs.has_key('duration'):
+            return frame <= last and frame + float(attrs.getValue('duration')) >= first
+        return first <= frame <= last
+
+    def flushPoints(self):
+        """
+        Append the point nodes read since the last call to the current dataset
+        """
+        if self.points:
+            self.datasets[-1].append_xml_columns(self.points)
+            self.points = collections.defaultdict(list)
+
     def endElement(self, name):
         if name == 'point':
             pass
+        elif name == 'dataset':
+            self.flushPoints()
+            self.curnode = self.curnode.parentNode
         elif name == 'sv':
             pass
         else:
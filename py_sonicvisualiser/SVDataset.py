@@ -21,32 +21,358 @@
 
 """
 This class is allows the storage of large continuous dataset
-in xml.dom.minidom documents
+in SVDocument trees
 """
 
-import xml.dom.minidom
+import bz2
 import collections
+import numpy as np
+from SVElement import _escape
+from SVBz2 import block_input_size
 
 
-class SVDataset2D(xml.dom.minidom.Text):
+def _label_dtype(nlabels):
     """
-    This class is aimed at storing large datasets in minidom documents
+    Smallest unsigned integer type able to store nlabels label codes
+    """
+    if nlabels <= 0x100:
+        return np.uint8
+    if nlabels <= 0x10000:
+        return np.uint16
+    return np.uint32
+
+
+class _Column(object):
+    """
+    Contiguous typed array with amortized constant time appends.
+    Only the first size elements of buf are meaningful.
+    """
+    __slots__ = ('buf', 'size')
+
+    def __init__(self, dtype):
+        self.buf = np.empty(0, dtype=dtype)
+        self.size = 0
+
+    def reserve(self, n):
+        if n > len(self.buf):
+            buf = np.empty(max(n, 2 * len(self.buf), 16), dtype=self.buf.dtype)
+            buf[:self.size] = self.buf[:self.size]
+            self.buf = buf
+
+    def append(self, v):
+        if self.size == len(self.buf):
+            self.reserve(self.size + 1)
+        self.buf[self.size] = v
+        self.size += 1
+
+    def extend(self, a):
+        a = np.asarray(a)
+        self.reserve(self.size + len(a))
+        self.buf[self.size:self.size + len(a)] = a
+        self.size += len(a)
+
+    def set(self, a):
+        # no copy is done if a is already a contiguous array of the right type
+        self.buf = np.ascontiguousarray(a, dtype=self.buf.dtype).reshape(-1)
+        self.size = len(self.buf)
+
+    def astype(self, dtype):
+        if self.buf.dtype != dtype:
+            self.buf = self.buf.astype(dtype)
+
+    def view(self):
+        ret = self.buf[:self.size]
+        ret.flags.writeable = False
+        return ret
+
+
+class _IntervalTree(object):
+    """
+    Static centered interval tree over closed intervals [starts, ends].
+    Each node stores the intervals containing its center, sorted by start
+    and by decreasing end. Small sets of intervals are stored in leaves
+    scanned linearly.
+    """
+    leafsize = 256
+
+    def __init__(self, starts, ends):
+        self.starts = starts
+        self.ends = ends
+        self.root = self._build(np.arange(len(starts)))
+
+    def _build(self, ids):
+        if len(ids) <= self.leafsize:
+            return (ids,)
+        starts = self.starts[ids]
+        ends = self.ends[ids]
+        center = np.median(np.concatenate((starts, ends)))
+        left = ends < center
+        right = starts > center
+        mid = ids[~(left | right)]
+        bystart = mid[np.argsort(self.starts[mid], kind='mergesort')]
+        byend = mid[np.argsort(-self.ends[mid], kind='mergesort')]
+        return (center, bystart, self.starts[bystart], byend, -self.ends[byend],
+                self._build(ids[left]), self._build(ids[right]))
+
+    def stab(self, q):
+        """
+        Unsorted indices of the intervals containing q
+        """
+        # integer bounds, avoiding the conversion of the arrays to float
+        lo = np.int64(np.floor(q))
+        hi = np.int64(np.ceil(q))
+        out = []
+        node = self.root
+        while True:
+            if len(node) == 1:
+                ids = node[0]
+                out.append(ids[(self.starts[ids] <= lo) & (self.ends[ids] >= hi)])
+                break
+            center, bystart, starts, byend, negends, left, right = node
+            if q < center:
+                out.append(bystart[:np.searchsorted(starts, lo, 'right')])
+                node = left
+            elif q > center:
+                out.append(byend[:np.searchsorted(negends, -hi, 'right')])
+                node = right
+            else:
+                out.append(bystart)
+                break
+        return np.concatenate(out)
+
+
+class SVDataset2D(object):
+    """
+    This class is aimed at storing large datasets in SVDocument trees
     datasets are stored as iterable structure (lists, numpy arrays, ...)
     This data is converted to sonic visualiser point nodes at writing time
     This allows to avoid the storage of very large xml trees in RAM,
-    and avoid swap 
+    and avoid swap
+
+    Points are stored in contiguous numpy arrays (int64 frames,
+    float64 or float32 values, unsigned integer label codes) exposed
+    as read-only arrays through the frames, values and labels attributes
+
+    Datasets obtained from a lazy parsing keep a reference to the location
+    of their content in the parsed file, which is decoded on first access.
+    Untouched lazy datasets are written by copying their original content.
+
+    Time range queries are answered using an index of the sorted frames,
+    built on first query and discarded when the points are modified.
+
+    When written to a writer able to splice bzip2 streams, the content of
+    the dataset is compressed as independent single block bzip2 streams,
+    which are kept and reused until the points are modified.
     """
-    def __init__(self, domdoc, datasetid, samplerate):
+    tagName = 'dataset'
+    _pointfmt = '<point label="%s" frame="%d" value="%f"/>'
+    # number of points serialized by a single string formatting operation
+    xml_chunksize = 4096
+
+    def __init__(self, domdoc, datasetid, samplerate, value_dtype=np.float64):
         self.datasetid = datasetid
-        self.frames = []
-        self.values = []
-        self.labels = []
-        self.label2int = dict()
-        self.int2label = dict()
+        self._frames = _Column(np.int64)
+        self._values = _Column(value_dtype)
+        self._labels = _Column(np.uint8)
+        self._label2int = dict()
+        self._int2label = dict()
+        # xml escaped labels, indexed by code
+        self._xmllabels = []
+        self._source = None
+        self._index = None
+        # (serialization parameters, compressed content)
+        self._compressed = None
         self.ownerDocument = domdoc
+        self.parentNode = None
         self.dimensions = 2
         self.samplerate = samplerate
 
+    def set_source(self, source):
+        """
+        Defer the decoding of the dataset points
+
+        :param source: object whose load method appends the dataset points
+            and iter_raw method yields the original content of the dataset node
+        """
+        self._source = source
+
+    def load(self):
+        """
+        Decode the dataset points if they were not already
+        """
+        if self._source is not None:
+            source = self._source
+            self._source = None
+            source.load(self)
+
+    def _loaded(self, name):
+        self.load()
+        return getattr(self, name)
+
+    frames = property(lambda self: self._loaded('_frames').view(), doc='frame indices (int64)')
+    values = property(lambda self: self._loaded('_values').view(), doc='point values')
+    labels = property(lambda self: self._loaded('_labels').view(), doc='label codes, see int2label')
+    label2int = property(lambda self: self._loaded('_label2int'))
+    int2label = property(lambda self: self._loaded('_int2label'))
+
+    def _modified(self):
+        """
+        Discard the indices and the compressed content depending on the points
+        """
+        self._index = None
+        self._compressed = None
+
+    def _frame_index(self):
+        """
+        Sorted frames, and the permutation sorting the points by frame
+        (None if they are already sorted)
+        """
+        if self._index is None:
+            frames = self.frames
+            if np.all(frames[1:] >= frames[:-1]):
+                self._index = (frames, None)
+            else:
+                order = np.argsort(frames, kind='mergesort')
+                self._index = (frames[order], order)
+        return self._index
+
+    def points_in(self, t0, t1):
+        """
+        Indices of the points whose time is in [t0, t1], sorted by time
+
+        :param t0: start time (seconds)
+        :param t1: end time (seconds)
+        :returns: integer array, to be used to index frames, values, labels
+        """
+        frames, order = self._frame_index()
+        # integer bounds, avoiding the conversion of frames to float
+        lo = np.searchsorted(frames, np.int64(np.ceil(t0 * self.samplerate)), 'left')
+        hi = max(lo, np.searchsorted(frames, np.int64(np.floor(t1 * self.samplerate)), 'right'))
+        if order is None:
+            return np.arange(lo, hi)
+        return order[lo:hi]
+
+    def _columns(self):
+        """
+        Columns storing the points
+        """
+        return [self._frames, self._values, self._labels]
+
+    def _set_columns(self, arrays):
+        """
+        Replace the points by arrays matching _columns, label codes
+        being relative to the vocabulary of the dataset
+        """
+        self._source = None
+        self._modified()
+        for col, a in zip(self._columns(), arrays):
+            col.set(a)
+
+    def _take(self, idx):
+        """
+        Keep the points of indices idx
+        """
+        self.load()
+        self._set_columns([col.view()[idx] for col in self._columns()])
+
+    def cloneNode(self, deep):
+        """
+        Copy of the dataset sharing no data with it. The points are copied
+        if deep is True, else the copy is empty but has the same label
+        vocabulary
+        """
+        ret = self.__class__(self.ownerDocument, self.datasetid, self.samplerate, self._values.buf.dtype)
+        if deep and self._source is not None:
+            # not decoded yet: the copy will decode the same content
+            ret.set_source(self._source)
+            return ret
+        ret._label2int.update(self.label2int)
+        ret._int2label.update(self.int2label)
+        ret._xmllabels.extend(self._xmllabels)
+        ret._labels.astype(self._labels.buf.dtype)
+        if deep:
+            ret._set_columns([col.view().copy() for col in self._columns()])
+        return ret
+
+    def shift(self, offset):
+        """
+        Add offset to the frames of the points
+        """
+        self.load()
+        self._modified()
+        self._frames.set(self._frames.view() + offset)
+
+    def extent(self, default):
+        """
+        First and last frames of the points, (default, default) if there is none
+        """
+        if len(self.frames) == 0:
+            return default, default
+        return int(self.frames.min()), int(self.frames.max())
+
+    def partition(self, bounds):
+        """
+        Partition the points between consecutive ranges of frames
+        [bounds[i], bounds[i + 1]), the last range including its end.
+        Points outside [bounds[0], bounds[-1]] are discarded
+
+        :param bounds: increasing frames (int64 array)
+        :returns: for each range, arrays matching _columns
+        """
+        frames = self.frames
+        n = len(bounds) - 1
+        seg = np.searchsorted(bounds, frames, 'right') - 1
+        seg[frames == bounds[-1]] = n - 1
+        idx = np.flatnonzero((seg >= 0) & (seg < n))
+        return self._split_columns(seg[idx], n, [col.view()[idx] for col in self._columns()])
+
+    @staticmethod
+    def _split_columns(seg, n, arrays):
+        """
+        Group the points of arrays by range index seg, keeping their order
+        """
+        order = np.argsort(seg, kind='mergesort')
+        counts = np.bincount(seg, minlength=n)
+        ends = np.cumsum(counts)
+        arrays = [a[order] for a in arrays]
+        return [[a[e - c:e] for a in arrays] for e, c in zip(ends, counts)]
+
+    def crop(self, first, last):
+        """
+        Keep the points in a range of frames
+
+        :param first: first frame of the range
+        :param last: last frame of the range
+        :returns: first and last frames of the remaining points,
+            (first, first) if there is none
+        """
+        frames = self.frames
+        self._take(np.flatnonzero((frames >= first) & (frames <= last)))
+        return self.extent(first)
+
+    def _label_code(self, l):
+        if l not in self._label2int:
+            self._label2int[l] = len(self._label2int)
+            self._int2label[len(self._int2label)] = l
+            self._xmllabels.append(_escape(l if isinstance(l, basestring) else str(l)))
+            self._labels.astype(_label_dtype(len(self._label2int)))
+        return self._label2int[l]
+
+    def _encode_labels(self, labels):
+        """
+        Convert an iterable of labels to an array of label codes.
+        New labels are registered in order of first appearance
+        """
+        if not isinstance(labels, np.ndarray):
+            labels = np.asarray(list(labels))
+        if len(labels) == 0:
+            return np.zeros(0, dtype=self._labels.buf.dtype)
+        uniq, first, inv = np.unique(labels, return_index=True, return_inverse=True)
+        order = np.argsort(first)
+        remap = np.empty(len(uniq), dtype=np.uint32)
+        remap[order] = [self._label_code(l) for l in uniq[order].tolist()]
+        return remap[inv]
+
     def set_data_from_iterable(self, frames, values, labels=None):
         """
         Initialize a dataset structure from iterable parameters
@@ -60,31 +386,186 @@ class SVDataset2D(xml.dom.minidom.Text):
             raise TypeError, "frames must be an iterable"
         if not isinstance(values, collections.Iterable):
             raise TypeError, "values must be an iterable"
+        if not hasattr(frames, '__len__'):
+            frames = list(frames)
+        if not hasattr(values, '__len__'):
+            values = list(values)
         assert(len(frames) == len(values))
-        self.frames = frames
-        self.values = values
+        self._source = None
+        self._modified()
+        self._frames.set(frames)
+        self._values.set(values)
         if labels is None:
-            self.label2int['New Point'] = 0
-            self.int2label[0] = 'New Point'
-            self.labels = [0 for i in xrange(len(frames))]
+            # the vocabulary may already hold other labels
+            code = self._label_code('New Point')
+            self._labels.set(np.full(len(frames), code, dtype=self._labels.buf.dtype))
         else:
             if not isinstance(labels, collections.Iterable):
                 raise TypeError, "labels must be an iterable"
-            for l in labels:
-                if l not in self.label2int:
-                    self.label2int[l] = len(self.label2int)
-                    self.int2label[len(self.int2label)] = l
-                self.labels.append(self.label2int[l])
-    
+            codes = self._encode_labels(labels)
+            assert(len(codes) == len(frames))
+            self._labels.set(codes)
+
+    def clear(self):
+        """
+        Remove the points of the dataset, keeping its label vocabulary
+        """
+        self._source = None
+        self._modified()
+        self._frames = _Column(self._frames.buf.dtype)
+        self._values = _Column(self._values.buf.dtype)
+        self._labels = _Column(self._labels.buf.dtype)
+
     def append_xml_point(self, attrs):
-        self.frames.append(int(attrs.getValue('frame')))
-        self.values.append(float(attrs.getValue('value')))
-        l = attrs.getValue('label')
-        if l not in self.label2int:
-            self.label2int[l] = len(self.label2int)
-            self.int2label[len(self.int2label)] = l
-        self.labels.append(self.label2int[l])
-            
+        self.load()
+        self._modified()
+        self._frames.append(int(attrs.getValue('frame')))
+        self._values.append(float(attrs.getValue('value')))
+        self._labels.append(self._label_code(attrs.getValue('label')))
+
+    def _window_mask(self, columns, first, last):
+        """
+        Points of columns in [first, last] frames, and the numeric
+        columns converted to compute it
+        """
+        # conversion through float64 is faster, and exact below 2**53
+        frames = np.array(columns['frame'], dtype=np.float64).astype(np.int64)
+        return (frames >= first) & (frames <= last), {'frame': frames}
+
+    def select_xml_columns(self, columns, first, last):
+        """
+        Keep the points of raw attribute columns in a window of frames.
+        Only the attributes defining the time of the points are converted,
+        the others are selected as strings.
+
+        :param columns: lists of attribute values indexed by attribute name
+        :param first: first frame of the window
+        :param last: last frame of the window
+        :returns: columns of the selected points, numeric columns being arrays
+        """
+        mask, converted = self._window_mask(columns, first, last)
+        idx = np.flatnonzero(mask)
+        if len(idx) == 0:
+            return {}
+        ret = {}
+        for k, v in columns.iteritems():
+            if k in converted:
+                ret[k] = converted[k][idx]
+            elif len(idx) == len(v):
+                ret[k] = v
+            else:
+                ret[k] = [v[i] for i in idx.tolist()]
+        return ret
+
+    def append_xml_columns(self, columns):
+        """
+        Append points given as the raw attribute strings of point nodes.
+        Bulk equivalent of append_xml_point
+
+        :param columns: lists of attribute values indexed by attribute name
+        :type columns: dict
+        """
+        self.load()
+        self._modified()
+        self._frames.extend(np.array(columns['frame'], dtype=np.int64))
+        self._values.extend(np.array(columns['value'], dtype=self._values.buf.dtype))
+        self._labels.extend(self._encode_labels(columns['label']))
+
+
+    def _xml_columns(self):
+        """
+        Numeric columns matching the fields of _pointfmt following the label
+        """
+        return [self.frames, self.values]
+
+    def _iter_xml_points(self, indent, newl):
+        """
+        Serialize the dataset points by chunks of xml_chunksize points.
+        Each chunk is formatted by a single string formatting operation
+        on a flattened block of python objects obtained from the columns.
+        """
+        fmt = indent.replace('%', '%%') + self._pointfmt + newl.replace('%', '%%')
+        self.load()
+        # labels are escaped once, when registered
+        vocab = self._xmllabels
+        cols = self._xml_columns()
+        codes = self.labels
+        if len(vocab) == 1:
+            # a single label: store it in the format string
+            fmt = fmt.replace('%s', vocab[0].replace('%', '%%'), 1)
+            vocab = None
+        else:
+            vocab = np.array(vocab, dtype=object)
+        first = int(vocab is not None)
+        n = len(codes)
+        for start in xrange(0, n, self.xml_chunksize):
+            stop = min(n, start + self.xml_chunksize)
+            block = np.empty((stop - start, first + len(cols)), dtype=object)
+            if vocab is not None:
+                block[:, 0] = vocab[codes[start:stop]]
+            for i, col in enumerate(cols):
+                block[:, first + i] = col[start:stop]
+            yield (fmt * (stop - start)) % tuple(block.ravel().tolist())
+
+    def _iter_xml_content(self, indent, addindent, newl):
+        """
+        Serialized content of the dataset node, between its tags
+        """
+        if self._source is not None and self._source.window is None:
+            # untouched lazy dataset: copy its original content
+            for chunk in self._source.iter_raw():
+                yield chunk
+            return
+        yield newl
+        for chunk in self._iter_xml_points(indent + addindent, newl):
+            yield chunk
+        yield indent
+
+    def update_digest(self, h):
+        """
+        Update a hash object with the points of the dataset. Datasets
+        of equal digests are serialized identically
+
+        :param h: hashlib object
+        """
+        if self._source is not None and self._source.window is None:
+            # untouched lazy dataset: its original content is copied
+            h.update('raw\0')
+            for chunk in self._source.iter_raw():
+                h.update(chunk)
+            return
+        self.load()
+        h.update('%s\0' % self.dimensions)
+        for col in self._columns():
+            a = col.view()
+            h.update('%s %d\0' % (a.dtype.str, len(a)))
+            h.update(a)
+        for i in xrange(len(self._int2label)):
+            label = self._int2label[i]
+            h.update(label.encode('utf-8') if isinstance(label, unicode) else label)
+            h.update('\0')
+
+    def compressed_content(self, indent, addindent, newl, compresslevel):
+        """
+        Serialized content of the dataset node compressed as independent
+        single block bzip2 streams, cached until the points are modified
+
+        :returns: list of bzip2 streams
+        """
+        key = (indent, addindent, newl, compresslevel)
+        if self._compressed is None or self._compressed[0] != key:
+            size = block_input_size(compresslevel)
+            streams = []
+            buf = ''
+            for chunk in self._iter_xml_content(indent, addindent, newl):
+                buf += chunk
+                while len(buf) >= size:
+                    streams.append(bz2.compress(buf[:size], compresslevel))
+                    buf = buf[size:]
+            if buf:
+                streams.append(bz2.compress(buf, compresslevel))
+            self._compressed = (key, streams)
+        return self._compressed[1]
 
     def writexml(self, writer, indent="", addindent="", newl=""):
         """
@@ -93,38 +574,148 @@ class SVDataset2D(xml.dom.minidom.Text):
         # dataset = self.data.appendChild(self.doc.createElement('dataset'))
         # dataset.setAttribute('id', str(imodel))
         # dataset.setAttribute('dimensions', '2')
-        writer.write('%s<dataset id="%s" dimensions="%s">%s' % (indent, self.datasetid, self.dimensions, newl))
-        indent2 = indent + addindent
-        for l, x, y in zip(self.labels, self.frames, self.values):
-            writer.write('%s<point label="%s" frame="%d" value="%f"/>%s' % (indent2, self.int2label[l], x, y, newl))
-        writer.write('%s</dataset>%s' % (indent, newl))
+        writer.write('%s<dataset id="%s" dimensions="%s">' % (indent, self.datasetid, self.dimensions))
+        if hasattr(writer, 'splice'):
+            writer.splice(self.compressed_content(indent, addindent, newl, writer.compresslevel))
+        elif hasattr(writer, 'digest'):
+            self.update_digest(writer.digest)
+        else:
+            for chunk in self._iter_xml_content(indent, addindent, newl):
+                writer.write(chunk)
+        writer.write('</dataset>%s' % newl)
 
 
 
 
 class SVDataset3D(SVDataset2D):
-    def __init__(self, domdoc, datasetid, samplerate):
-        SVDataset2D.__init__(self, domdoc, datasetid, samplerate)
-        self.durations = []
+    def __init__(self, domdoc, datasetid, samplerate, value_dtype=np.float64):
+        SVDataset2D.__init__(self, domdoc, datasetid, samplerate, value_dtype)
+        self._durations = _Column(np.int64)
+        self._tree = None
         self.dimensions = 3
 
+    _pointfmt = '<point label="%s" frame="%d" value="%f" duration="%d"/>'
+
+    durations = property(lambda self: self._loaded('_durations').view(), doc='durations in frames (int64)')
+
+    def _modified(self):
+        SVDataset2D._modified(self)
+        self._tree = None
+
+    def _columns(self):
+        return SVDataset2D._columns(self) + [self._durations]
+
+    def extent(self, default):
+        """
+        First frame and end of the intervals, (default, default) if there is none
+        """
+        if len(self.frames) == 0:
+            return default, default
+        return int(self.frames.min()), int((self.frames + self.durations).max())
+
+    def partition(self, bounds):
+        """
+        Partition the intervals between consecutive ranges of frames
+        [bounds[i], bounds[i + 1]]. Intervals overlapping several ranges
+        are duplicated and clipped at the boundaries of the ranges.
+        Intervals outside [bounds[0], bounds[-1]] are discarded
+
+        :param bounds: increasing frames (int64 array)
+        :returns: for each range, arrays matching _columns
+        """
+        starts = self.frames
+        ends = starts + self.durations
+        n = len(bounds) - 1
+        first = np.searchsorted(bounds, starts, 'right') - 1
+        first[starts == bounds[-1]] = n - 1
+        last = np.maximum(np.searchsorted(bounds, ends, 'left') - 1, first)
+        first = np.maximum(first, 0)
+        last = np.minimum(last, n - 1)
+        counts = np.maximum(last - first + 1, 0)
+        # one copy of each interval per overlapped range
+        idx = np.repeat(np.arange(len(starts)), counts)
+        seg = np.repeat(first, counts) + np.arange(len(idx)) - np.repeat(np.cumsum(counts) - counts, counts)
+        arrays = [col.view()[idx] for col in self._columns()]
+        clipstarts = np.maximum(arrays[0], bounds[seg])
+        arrays[3] = np.minimum(arrays[0] + arrays[3], bounds[seg + 1]) - clipstarts
+        arrays[0] = clipstarts
+        return self._split_columns(seg, n, arrays)
+
+    def crop(self, first, last):
+        """
+        Keep the intervals overlapping a range of frames, clipped
+        at the boundaries of the range
+
+        :param first: first frame of the range
+        :param last: last frame of the range
+        :returns: first frame and end of the remaining intervals,
+            (first, first) if there is none
+        """
+        starts = self.frames
+        ends = starts + self.durations
+        # intervals only touching the range are dropped, unless they are empty
+        idx = np.flatnonzero((starts <= last) & (ends >= first) & ((starts < last) & (ends > first) | (starts == ends)))
+        starts = np.maximum(starts[idx], first)
+        ends = np.minimum(ends[idx], last)
+        self._take(idx)
+        self._frames.set(starts)
+        self._durations.set(ends - starts)
+        return self.extent(first)
+
+    def _interval_tree(self):
+        if self._tree is None:
+            self._tree = _IntervalTree(self.frames, self.frames + self.durations)
+        return self._tree
+
+    def intervals_at(self, t):
+        """
+        Indices of the intervals containing time t, in dataset order
+
+        :param t: time (seconds)
+        """
+        return np.sort(self._interval_tree().stab(t * self.samplerate))
+
+    def intervals_overlapping(self, t0, t1):
+        """
+        Indices of the intervals overlapping [t0, t1], in dataset order
+
+        :param t0: start time (seconds)
+        :param t1: end time (seconds)
+        """
+        if t1 < t0:
+            return np.zeros(0, dtype=np.intp)
+        # intervals starting before t0 and containing it,
+        # and intervals starting in [t0, t1]
+        before = self._interval_tree().stab(t0 * self.samplerate)
+        before = before[self.frames[before] < t0 * self.samplerate]
+        return np.sort(np.concatenate((before, self.points_in(t0, t1))))
+
     def set_data_from_iterable(self, frames, values, durations, labels=None):
         SVDataset2D.set_data_from_iterable(self, frames, values, labels)
         if not isinstance(durations, collections.Iterable):
             raise TypeError, "durations must be an iterable"
+        if not hasattr(durations, '__len__'):
+            durations = list(durations)
         assert(len(self.frames) == len(durations))
-        self.durations = durations
+        self._durations.set(durations)
+
+    def clear(self):
+        SVDataset2D.clear(self)
+        self._durations = _Column(np.int64)
 
     def append_xml_point(self, attrs):
         SVDataset2D.append_xml_point(self, attrs)
-        self.durations.append(float(attrs.getValue('duration')))
+        self._durations.append(float(attrs.getValue('duration')))
 
-    def writexml(self, writer, indent="", addindent="", newl=""):
-        """
-        Write the continuous  dataset using sonic visualiser xml conventions
-        """
-        writer.write('%s<dataset id="%s" dimensions="%s">%s' % (indent, self.datasetid, self.dimensions, newl))
-        indent2 = addindent + indent
-        for l, x, y, d in zip(self.labels, self.frames, self.values, self.durations):
-            writer.write('%s<point label="%s" frame="%d" value="%f" duration="%d"/>%s' % (indent2, self.int2label[l], x, y, d, newl))
-        writer.write('%s</dataset>%s' % (indent, newl))
+    def append_xml_columns(self, columns):
+        SVDataset2D.append_xml_columns(self, columns)
+        self._durations.extend(np.array(columns['duration'], dtype=np.float64))
+
+    def _window_mask(self, columns, first, last):
+        # intervals overlapping the window
+        frames = np.array(columns['frame'], dtype=np.float64).astype(np.int64)
+        durations = np.array(columns['duration'], dtype=np.float64)
+        return (frames <= last) & (frames + durations >= first), {'frame': frames, 'duration': durations}
+
+    def _xml_columns(self):
+        return [self.frames, self.values, self.durations]
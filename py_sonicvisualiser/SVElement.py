@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 David Doukhan <david.doukhan@gmail.com>
+
+# This file is part of py_sonicvisualiser.
+
+# py_sonicvisualiser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# py_sonicvisualiser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with TimeSide.  If not, see <http://www.gnu.org/licenses/>.
+
+# Author: David Doukhan <david.doukhan@gmail.com>
+
+
+"""
+Lightweight element tree used to store the structure of sonic visualiser
+environments (models, layers, views, selections).
+
+The subset of the xml.dom.minidom interface used to build and explore
+environments is provided by slotted objects, and documents are serialized
+exactly as minidom does. Nodes are any object with a writexml method,
+such as SVDataset2D.
+"""
+
+import StringIO
+
+
+def _escape(value):
+    return value.replace('&', '&amp;').replace('<', '&lt;').replace('"', '&quot;').replace('>', '&gt;')
+
+
+class SVElement(object):
+    """
+    Element node, with a dictionnary of attributes and a list of child nodes
+    """
+    __slots__ = ('tagName', 'attributes', 'childNodes', 'parentNode', 'ownerDocument')
+
+    def __init__(self, tagName, ownerDocument=None):
+        self.tagName = tagName
+        self.attributes = {}
+        self.childNodes = []
+        self.parentNode = None
+        self.ownerDocument = ownerDocument
+
+    nodeName = property(lambda self: self.tagName)
+
+    def __repr__(self):
+        return '<SVElement: %s>' % self.tagName
+
+    def appendChild(self, node):
+        if getattr(node, 'parentNode', None) is not None:
+            node.parentNode.removeChild(node)
+        self.childNodes.append(node)
+        node.parentNode = self
+        return node
+
+    def insertBefore(self, node, refnode):
+        if refnode is None:
+            return self.appendChild(node)
+        if getattr(node, 'parentNode', None) is not None:
+            node.parentNode.removeChild(node)
+        self.childNodes.insert(self.childNodes.index(refnode), node)
+        node.parentNode = self
+        return node
+
+    def removeChild(self, node):
+        self.childNodes.remove(node)
+        node.parentNode = None
+        return node
+
+    def cloneNode(self, deep):
+        """
+        Copy of the element, with copies of its descendants if deep is True
+        """
+        ret = SVElement(self.tagName, self.ownerDocument)
+        ret.attributes = dict(self.attributes)
+        if deep:
+            for node in self.childNodes:
+                ret.appendChild(node.cloneNode(True))
+        return ret
+
+    def setAttribute(self, name, value):
+        self.attributes[name] = value
+
+    def getAttribute(self, name):
+        return self.attributes.get(name, '')
+
+    def hasAttribute(self, name):
+        return name in self.attributes
+
+    def removeAttribute(self, name):
+        del self.attributes[name]
+
+    def getElementsByTagName(self, name):
+        """
+        Descendant nodes whose tagName is name, in document order.
+        '*' matches all the elements
+        """
+        ret = []
+        self._get_elements(name, ret)
+        return ret
+
+    def _get_elements(self, name, ret):
+        for node in self.childNodes:
+            if name == '*' or getattr(node, 'tagName', None) == name:
+                ret.append(node)
+            if isinstance(node, SVElement):
+                node._get_elements(name, ret)
+
+    def writexml(self, writer, indent="", addindent="", newl=""):
+        head = ''.join([' %s="%s"' % (k, _escape(v)) for k, v in sorted(self.attributes.iteritems())])
+        if self.childNodes:
+            writer.write('%s<%s%s>%s' % (indent, self.tagName, head, newl))
+            for node in self.childNodes:
+                node.writexml(writer, indent + addindent, addindent, newl)
+            writer.write('%s</%s>%s' % (indent, self.tagName, newl))
+        else:
+            writer.write('%s<%s%s/>%s' % (indent, self.tagName, head, newl))
+
+
+class SVDocument(object):
+    """
+    Document made of a doctype declaration and a root element
+
+    Args:
+      tagName(str): name of the root element
+      doctype(str): name of the document type
+    """
+    __slots__ = ('documentElement', 'doctype')
+
+    def __init__(self, tagName='sv', doctype='sonic-visualiser'):
+        self.doctype = doctype
+        self.documentElement = SVElement(tagName, self)
+
+    def cloneNode(self, deep):
+        ret = SVDocument(self.documentElement.tagName, self.doctype)
+        if deep:
+            ret.documentElement = self.documentElement.cloneNode(True)
+            for node in [ret.documentElement] + ret.documentElement.getElementsByTagName('*'):
+                node.ownerDocument = ret
+        return ret
+
+    def createElement(self, tagName):
+        return SVElement(tagName, self)
+
+    @property
+    def childNodes(self):
+        return [self.documentElement]
+
+    def getElementsByTagName(self, name):
+        ret = [self.documentElement] if name in ('*', self.documentElement.tagName) else []
+        self.documentElement._get_elements(name, ret)
+        return ret
+
+    def writexml(self, writer, indent="", addindent="", newl=""):
+        writer.write('<?xml version="1.0" ?>%s' % newl)
+        if self.doctype is not None:
+            writer.write('<!DOCTYPE %s>%s' % (self.doctype, newl))
+        self.documentElement.writexml(writer, indent, addindent, newl)
+
+    def toprettyxml(self, indent='\t', newl='\n'):
+        f = StringIO.StringIO()
+        self.writexml(f, '', indent, newl)
+        return f.getvalue()
@@ -25,16 +25,84 @@ consisting of a reference to a wav audio sound file, and several
 annotation layers
 """
 
-import xml.dom.minidom as minidom
-import xml.sax as sax
+import copy
+import math
+import os
 from bz2 import BZ2File
-from os.path import basename
-#import wave
-import numpy as np
-from SVDataset import SVDataset2D, SVDataset3D
-from SVContentHandler import SVContentHandler
-import scipy.io.wavfile as SW
-import wave
+from os.path import basename, exists, samefile
+# numpy, scipy, wave, xml.sax and the parsers are imported by the code
+# paths requiring them, to keep the import of the package fast
+from SVElement import SVDocument, SVElement
+from SVBz2 import BZ2Reader, ParallelBZ2Writer, SplicingBZ2Writer
+from SVAudioProbe import probe, ProbeCache
+
+
+def _numeric_array(a, name):
+    """
+    Convert a sequence of numbers to a 1-D numpy array.
+    Numpy arrays are returned without copy
+    """
+    import numpy as np
+    a = np.asarray(a)
+    if a.ndim != 1 or a.dtype.kind not in 'biuf':
+        raise TypeError('%s must be a 1-D sequence of numbers, got %s' % (name, a.dtype))
+    return a
+
+
+def _extrema(a, seq):
+    """
+    Minimum and maximum of the array a converted from the sequence seq,
+    taken from seq so that their representation is kept
+    """
+    imin, imax = a.argmin(), a.argmax()
+    if seq is a:
+        return a[imin], a[imax]
+    return seq[imin], seq[imax]
+
+
+# segment environments saved by the workers of split_file
+_split_envs = None
+
+
+def _save_split_env(task):
+    i, outfname, compresslevel = task
+    _split_envs[i].save(outfname, compresslevel=compresslevel)
+
+
+def _frames(t, samplerate):
+    """
+    Convert times in seconds to frame indices
+    """
+    import numpy as np
+    return (t * samplerate).astype(np.int64)
+
+
+def _probe_media(wavpath, cache):
+    """
+    Sample rate and number of frames of an audio file, see
+    SVEnv.init_from_wave_file
+    """
+    if isinstance(cache, basestring):
+        cache = ProbeCache(cache)
+    try:
+        samplerate, nframes = probe(wavpath) if cache is None else cache.probe(wavpath)
+    except (ValueError, IOError):
+        try:
+            import scipy.io.wavfile as SW
+            samplerate, data =  SW.read(wavpath)
+            nframes = data.shape[0]
+        except:
+            # scipy cannot handle 24 bit wav files
+            # and wave cannot handle 32 bit wav files
+            try:
+                import wave
+                w = wave.open(wavpath)
+                samplerate = w.getframerate()
+                nframes = w.getnframes()
+            except:
+                raise Exception('Cannot decode wavefile ' + wavpath)
+    return samplerate, nframes
+
 
 class SVEnv:
     """
@@ -51,9 +119,7 @@ class SVEnv:
           wavpath(str): Full path to the wav file used in the current environment
 
         """
-        imp = minidom.getDOMImplementation()
-        dt = imp.createDocumentType('sonic-visualiser', None, None)
-        self.doc = doc = imp.createDocument(None,'sv', dt)
+        self.doc = doc = SVDocument('sv', 'sonic-visualiser')
         root = doc.documentElement
         self.__dname = dict()
 
@@ -76,34 +142,62 @@ class SVEnv:
 
 
     @staticmethod
-    def init_from_wave_file(wavpath):
+    def init_from_wave_file(wavpath, cache=None):
         """Init a sonic visualiser environment structure based the analysis 
         of the main audio file. The audio file have to be encoded in wave
+        (RIFF/WAVE, RF64/BW64, Sony Wave64), FLAC, AIFF/AIFF-C or Ogg Vorbis
+
+        Sample rate and number of frames are read from the file headers.
+        Wave files whose headers cannot be interpreted are decoded using
+        scipy or wave.
 
         Args:
           wavpath(str): the full path to the wavfile 
-        """
 
-        try:
-            samplerate, data =  SW.read(wavpath)
-            nframes = data.shape[0]
-        except:
-            # scipy cannot handle 24 bit wav files
-            # and wave cannot handle 32 bit wav files
-            try:
-                w = wave.open(wavpath)
-                samplerate = w.getframerate()
-                nframes = w.getnframes()
-            except:
-                raise Exception('Cannot decode wavefile ' + wavpath)
+        Kwargs:
+          cache(ProbeCache or str): persistent cache of the probing results,
+            or path to its database
+        """
 
+        samplerate, nframes = _probe_media(wavpath, cache)
         return SVEnv(samplerate, nframes, wavpath)
 
     @staticmethod
-    def parse(svenvfname):
-        f = BZ2File(svenvfname)
-        svch = SVContentHandler()
-        sax.parse(f, svch)
+    def parse(svenvfname, parser='expat', lazy=False, nworkers=1, window=None):
+        """Init a sonic visualiser environment structure from an existing
+        sonic visualiser environment file
+
+        Args:
+          svenvfname(str): full path to the sv environment file
+
+        Kwargs:
+          parser(str): 'expat' for the fast path parser based on pyexpat,
+            'sax' for the xml.sax based parser
+          lazy(bool): with the expat parser, datasets points are decoded
+            only when accessed, and untouched datasets are saved by copying
+            their original content
+          nworkers(int): number of processes decompressing the streams of
+            multi-stream files (such as the files written by pbzip2) in
+            parallel. None uses all the cpus
+          window((float, float)): if set, only the points whose time
+            (seconds) is in this range, and the intervals overlapping it,
+            are kept. Other points are discarded by the parser before the
+            conversion of their values and labels
+        """
+        from SVContentHandler import SVContentHandler
+        from SVExpatParser import SVExpatParser, SVStreamReader
+        f = BZ2Reader(svenvfname, nworkers)
+        if parser == 'expat':
+            svch = SVExpatParser(SVStreamReader(svenvfname) if lazy else None, window)
+            svch.parse(f)
+        elif parser == 'sax':
+            if lazy:
+                raise ValueError('lazy parsing requires the expat parser')
+            import xml.sax as sax
+            svch = SVContentHandler(window)
+            sax.parse(f, svch)
+        else:
+            raise ValueError('unknown parser %s' % parser)
         #print svch.dom.toprettyxml()
         
         ret = SVEnv(svch.samplerate, svch.nframes, svch.mediafile)
@@ -150,6 +244,9 @@ class SVEnv:
           x (float iterable): temporal indices of the dataset
           y (float iterable): values of the dataset
 
+        Numpy arrays are used without copy when y is a contiguous float64
+        array
+
         Kwargs:
           view (<DOM Element: view>): environment view used to display the spectrogram, if set to None, a new view is created
 
@@ -157,7 +254,21 @@ class SVEnv:
           <DOM Element: view>: the view used to store the spectrogram
 
         """
-        
+        from SVDataset import SVDataset2D
+        x = _numeric_array(x, 'x')
+        values = _numeric_array(y, 'y')
+        # sequences of ints keep their representation in the model extrema
+        ymin, ymax = _extrema(values, y)
+        dataset = SVDataset2D(self.doc, None, self.samplerate)
+        dataset.set_data_from_iterable(_frames(x, self.samplerate), values)
+        return self._add_continuous_dataset(dataset, int(x.min() * self.samplerate), int(x.max() * self.samplerate), ymin, ymax,
+                                            colourName, colour, name, view, vscale, presentationName)
+
+    def _add_continuous_dataset(self, dataset, start, end, ymin, ymax, colourName, colour, name, view, vscale, presentationName):
+        """
+        add the model and layers of a continuous annotation dataset,
+        whose time boundaries (frames) and value extrema are known
+        """
         model = self.data.appendChild(self.doc.createElement('model'))
         imodel = self.nbdata
         
@@ -165,14 +276,14 @@ class SVEnv:
                               ('dataset', imodel),
                               ('name', name),
                               ('sampleRate', self.samplerate),
-                              ('start', int(min(x) * self.samplerate)),
-                              ('end', int(max(x) * self.samplerate)),
+                              ('start', start),
+                              ('end', end),
                               ('type', 'sparse'),
                               ('dimensions', '2'),
                               ('resolution', '1'),
                               ('notifyOnAdd', 'true'),
-                              ('minimum', min(y)),
-                              ('maximum', max(y)),
+                              ('minimum', ymin),
+                              ('maximum', ymax),
                               ('units', '')
                               ]:
             model.setAttribute(atname, str(atval))
@@ -185,8 +296,8 @@ class SVEnv:
         # datasetnode = SVDataset2D(self.doc, str(imodel), self.samplerate)
         # datasetnode.set_data_from_iterable(map(int, np.array(x) * self.samplerate), y)
         # data = dataset.appendChild(datasetnode)
-        dataset = self.data.appendChild(SVDataset2D(self.doc, str(imodel), self.samplerate))
-        dataset.set_data_from_iterable(map(int, np.array(x) * self.samplerate), y)
+        dataset.datasetid = str(imodel)
+        self.data.appendChild(dataset)
         self.nbdata += 2
 
         ###### add layers
@@ -198,8 +309,8 @@ class SVEnv:
             vallayer.setAttribute('presentationName', presentationName)
         if vscale is None:
             vallayer.setAttribute('verticalScale', '0')
-            vallayer.setAttribute('scaleMinimum', str(min(y)))
-            vallayer.setAttribute('scaleMaximum', str(max(y)))
+            vallayer.setAttribute('scaleMinimum', str(ymin))
+            vallayer.setAttribute('scaleMaximum', str(ymax))
         else:
             vallayer.setAttribute('verticalScale', '0')
             vallayer.setAttribute('scaleMinimum', str(vscale[0]))
@@ -226,7 +337,22 @@ class SVEnv:
           view (<DOM Element: view>): environment view used to display the spectrogram, if set to None, a new view is created
 
         """
+        import numpy as np
+        from SVDataset import SVDataset3D
+        temp_idx = _numeric_array(temp_idx, 'temp_idx')
+        durations = _numeric_array(durations, 'durations')
+        if values is None:
+            values = np.zeros(len(temp_idx))
+        else:
+            values = _numeric_array(values, 'values')
+        dataset = SVDataset3D(self.doc, None, self.samplerate)
+        dataset.set_data_from_iterable(_frames(temp_idx, self.samplerate), values, _frames(durations, self.samplerate), labels)
+        return self._add_interval_dataset(dataset, colourName, colour, name, view, presentationName)
 
+    def _add_interval_dataset(self, dataset, colourName, colour, name, view, presentationName):
+        """
+        add the model and layers of a labelled interval annotation dataset
+        """
         model = self.data.appendChild(self.doc.createElement('model'))
         imodel = self.nbdata
         for atname, atval in [('id', imodel + 1),
@@ -243,10 +369,8 @@ class SVEnv:
                               ]:
             model.setAttribute(atname, str(atval))
 
-        dataset = self.data.appendChild(SVDataset3D(self.doc, str(imodel), self.samplerate))
-        if values is None:
-            values = ([0] * len(temp_idx))
-        dataset.set_data_from_iterable(map(int, np.array(temp_idx) * self.samplerate), values, map(int, np.array(durations) * self.samplerate), labels)
+        dataset.datasetid = str(imodel)
+        self.data.appendChild(dataset)
         
 
         # dataset = self.data.appendChild(self.doc.createElement('dataset'))
@@ -277,19 +401,438 @@ class SVEnv:
         return view
 
 
-    def save(self, outfname):
+    def crop(self, t0, t1):
+        """
+        Restrict the annotations of the environment to a time range
+
+        Points outside the range are removed, and intervals overlapping
+        its boundaries are clipped. The extents of the sparse models and
+        the selections are updated, and the views are centred on the range.
+        Frames remain relative to the main audio file.
+
+        Args:
+          t0(float): start of the range (seconds)
+          t1(float): end of the range (seconds)
+        """
+        first = int(math.ceil(t0 * self.samplerate))
+        last = int(math.floor(t1 * self.samplerate))
+        if last < first:
+            raise ValueError('empty time range [%s, %s]' % (t0, t1))
+        for dataset in self.__datasets():
+            dataset.crop(first, last)
+        self.__fit_range(first, last)
+
+    def __fit_range(self, first, last):
+        """
+        Update the extents of the sparse models, the selections and the
+        views after the restriction of the datasets to [first, last] frames
+        """
+        models = dict((node.getAttribute('dataset'), node) for node in self.data.childNodes
+                      if getattr(node, 'tagName', None) == 'model' and node.hasAttribute('dataset'))
+        for dataset in self.__datasets():
+            start, end = dataset.extent(first)
+            model = models.get(dataset.datasetid)
+            if model is not None:
+                for atname, atval in [('start', start), ('end', end)]:
+                    if model.hasAttribute(atname):
+                        model.setAttribute(atname, str(atval))
+
+        selections = getattr(self, 'selections', None)
+        if selections is not None:
+            for sel in selections.getElementsByTagName('selection'):
+                start = max(first, int(sel.getAttribute('start')))
+                end = min(last, int(sel.getAttribute('end')))
+                if start < end:
+                    sel.setAttribute('start', str(start))
+                    sel.setAttribute('end', str(end))
+                else:
+                    sel.parentNode.removeChild(sel)
+
+        zoom = max(1, int(math.ceil(float(last - first) / self.defwidth)))
+        for view in self.display.getElementsByTagName('view'):
+            view.setAttribute('centre', str((first + last) // 2))
+            view.setAttribute('zoom', str(zoom))
+
+    @staticmethod
+    def crop_file(svenvfname, outfname, t0, t1, nworkers=1):
+        """
+        Write the annotations of a sv environment file restricted to a time
+        range, see crop. Only the points of the range are held in memory
+
+        Args:
+          svenvfname(str): full path to the sv environment file
+          outfname(str): full path to the cropped environment file
+          t0(float): start of the range (seconds)
+          t1(float): end of the range (seconds)
+
+        Kwargs:
+          nworkers(int): number of processes used to decompress and
+            compress the environments, see parse and save
+        """
+        sve = SVEnv.parse(svenvfname, nworkers=nworkers, window=(t0, t1))
+        sve.crop(t0, t1)
+        sve.save(outfname, nworkers)
+
+    def split(self, boundaries):
+        """
+        Split the environment into consecutive time segments
+
+        Each point belongs to a single segment. Intervals overlapping
+        several segments are clipped at their boundaries and appear in
+        each of them. Annotations outside the segments are discarded.
+        Models, selections and views are updated as in crop.
+
+        Args:
+          boundaries(float sequence): increasing times (seconds) b0 .. bN
+            defining the N segments [b(i), b(i+1)), the last segment
+            including its end
+
+        Returns:
+          list of SVEnv: the N segment environments
+        """
+        import numpy as np
+        bounds = np.array([int(math.ceil(b * self.samplerate)) for b in boundaries], dtype=np.int64)
+        if len(bounds) < 2 or np.any(bounds[1:] <= bounds[:-1]):
+            raise ValueError('boundaries must be at least 2 increasing times')
+        envs = [self.__clone() for i in xrange(len(bounds) - 1)]
+        targets = [env.__datasets() for env in envs]
+        for j, dataset in enumerate(self.__datasets()):
+            for datasets, arrays in zip(targets, dataset.partition(bounds)):
+                datasets[j]._set_columns(arrays)
+        for i, env in enumerate(envs):
+            env.__fit_range(int(bounds[i]), int(bounds[i + 1]))
+        return envs
+
+    @staticmethod
+    def split_file(svenvfname, boundaries, outfnames, nworkers=None, compresslevel=9):
+        """
+        Split a sv environment file into consecutive time segments, see split.
+        The source file is read once, and the segment environments are
+        serialized and compressed by a pool of processes
+
+        Args:
+          svenvfname(str): full path to the sv environment file
+          boundaries(float sequence): increasing times (seconds) b0 .. bN
+            defining N segments
+          outfnames(str sequence): full paths to the N segment files
+
+        Kwargs:
+          nworkers(int): number of processes, None uses all the cpus
+          compresslevel(int): bzip2 compression level, between 1 and 9
+        """
+        global _split_envs
+        if len(outfnames) != len(boundaries) - 1:
+            raise ValueError('%d output files for %d segments' % (len(outfnames), len(boundaries) - 1))
+        sve = SVEnv.parse(svenvfname, window=(boundaries[0], boundaries[-1]))
+        _split_envs = sve.split(boundaries)
+        del sve
+        tasks = [(i, outfname, compresslevel) for i, outfname in enumerate(outfnames)]
+        try:
+            if nworkers == 1:
+                map(_save_split_env, tasks)
+            else:
+                import multiprocessing
+                # forked workers inherit the segment environments
+                pool = multiprocessing.Pool(nworkers)
+                try:
+                    pool.map(_save_split_env, tasks, chunksize=1)
+                finally:
+                    pool.close()
+                    pool.join()
+        finally:
+            _split_envs = None
+
+    def _add_layer_copy(self, layer, model):
+        """
+        add a copy of a layer, with a new id
+
+        Args:
+          layer (<DOM Element: layer>): layer to copy
+          model (str): id of the model displayed by the copy
+
+        Returns:
+          <DOM Element: layer>: the copy of the layer
+        """
+        layer = self.data.appendChild(layer.cloneNode(False))
+        layer.setAttribute('id', str(self.nbdata))
+        layer.setAttribute('model', model)
+        self.nbdata += 1
+        return layer
+
+    def _add_dataset_copy(self, dataset, model, layer):
+        """
+        add a dataset displayed by copies of a model and a layer, whose ids
+        are rewritten
+
+        Args:
+          dataset: dataset node, its id is set
+          model (<DOM Element: model>): model of the dataset
+          layer (<DOM Element: layer>): layer of the model
+
+        Returns:
+          <DOM Element: layer>: the copy of the layer
+        """
+        imodel = self.nbdata
+        model = self.data.appendChild(model.cloneNode(False))
+        model.setAttribute('id', str(imodel + 1))
+        model.setAttribute('dataset', str(imodel))
+        dataset.datasetid = str(imodel)
+        self.data.appendChild(dataset)
+        self.nbdata += 2
+        return self._add_layer_copy(layer, str(imodel + 1))
+
+    def _add_view_copy(self, view, layers):
+        """
+        add a copy of a view, whose layer references are rewritten
+
+        Args:
+          view (<DOM Element: view>): view to copy
+          layers (dict): copies of the layers displayed by the view,
+            indexed by the ids of the original layers. References to
+            other layers are dropped
+
+        Returns:
+          <DOM Element: view>: the copy of the view
+        """
+        copy = self.display.appendChild(view.cloneNode(False))
+        copy.setAttribute('centre', str(self.nframes / 2))
+        for ref in view.childNodes:
+            if ref.tagName != 'layer':
+                copy.appendChild(ref.cloneNode(True))
+            elif ref.getAttribute('id') in layers:
+                layer = layers[ref.getAttribute('id')]
+                ref = copy.appendChild(ref.cloneNode(False))
+                for at in ['id', 'type', 'name', 'model']:
+                    ref.setAttribute(at, layer.getAttribute(at))
+        return copy
+
+    def _add_layer_view(self, layer, view=None):
+        """
+        display a layer in a view
+
+        Kwargs:
+          view (<DOM Element: view>): environment view used to display the
+            layer, if set to None, a new view is created
+
+        Returns:
+          <DOM Element: view>: the view used to display the layer
+        """
+        if view is None:
+            view = self.__add_view()
+            self.__add_layer_reference(view, self.__add_time_ruler())
+        self.__add_layer_reference(view, layer)
+        return view
+
+    def instantiate(self, wavpath, samplerate=None, nframes=None, cache=None):
+        """
+        Use the environment as a template for another audio file
+
+        The models, layers, views and their styling are copied without
+        being rebuilt. The main audio model and the views refer to the new
+        audio file, selections are removed and the annotation datasets of
+        the copy are empty: they are filled using set_continuous_annotations
+        and set_interval_annotations.
+
+        Args:
+          wavpath(str): full path to the audio file of the copy
+
+        Kwargs:
+          samplerate(int): sample rate (Hz) of the audio file
+          nframes(int): number of samples of the audio file
+            if samplerate or nframes is None, they are read from the
+            audio file, see init_from_wave_file
+          cache(ProbeCache or str): persistent cache of the probing results
+
+        Returns:
+          SVEnv: the environment of the audio file
+        """
+        if samplerate is None or nframes is None:
+            samplerate, nframes = _probe_media(wavpath, cache)
+        ret = self.__clone()
+        ret.samplerate = samplerate
+        ret.nframes = nframes
+        # models and datasets are children of data, views of display
+        for node in ret.data.childNodes:
+            if node.tagName == 'model':
+                node.setAttribute('sampleRate', str(samplerate))
+                if node.getAttribute('mainModel') == 'true':
+                    node.setAttribute('name', basename(wavpath))
+                    node.setAttribute('file', wavpath)
+                    node.setAttribute('end', str(nframes))
+            elif node.tagName == 'dataset':
+                node.samplerate = samplerate
+        selections = getattr(ret, 'selections', None)
+        if selections is not None:
+            del selections.childNodes[:]
+        for node in ret.display.childNodes:
+            if node.tagName == 'view':
+                node.setAttribute('centre', str(nframes / 2))
+        return ret
+
+    def set_continuous_annotations(self, i, x, y):
+        """
+        Replace the points of a continuous annotation layer, such as the
+        layers of an environment returned by instantiate
+
+        The extent of the model is updated. Layers whose vertical scale
+        matched the extrema of the previous points follow the new ones.
+        As with add_continuous_annotations, the points may not be empty.
+
+        Args:
+          i (int): rank of the annotation dataset in the environment
+          x (float iterable): temporal indices of the dataset
+          y (float iterable): values of the dataset
+        """
+        from SVDataset import SVDataset3D
+        dataset, model, layers = self.__annotation(i)
+        if isinstance(dataset, SVDataset3D):
+            raise TypeError('dataset %d stores intervals' % i)
+        x = _numeric_array(x, 'x')
+        values = _numeric_array(y, 'y')
+        if len(x) == 0:
+            # the extent of the model and the scales of its layers would be stale
+            raise ValueError('empty continuous annotation')
+        dataset.set_data_from_iterable(_frames(x, self.samplerate), values)
+        ymin, ymax = _extrema(values, y)
+        for layer in layers:
+            if (layer.getAttribute('scaleMinimum'), layer.getAttribute('scaleMaximum')) == (model.getAttribute('minimum'), model.getAttribute('maximum')):
+                layer.setAttribute('scaleMinimum', str(ymin))
+                layer.setAttribute('scaleMaximum', str(ymax))
+        for atname, atval in [('start', int(x.min() * self.samplerate)),
+                              ('end', int(x.max() * self.samplerate)),
+                              ('minimum', ymin),
+                              ('maximum', ymax)]:
+            model.setAttribute(atname, str(atval))
+
+    def set_interval_annotations(self, i, temp_idx, durations, labels, values=None):
+        """
+        Replace the intervals of a labelled interval annotation layer, such
+        as the layers of an environment returned by instantiate
+
+        Args:
+          i (int): rank of the annotation dataset in the environment
+          temp_idx (float iterable): The temporal indices of invervals
+          durations (float iterable): intervals durations
+          labels (string iterable): interval labels
+          values (int iterable): interval numeric values, if set to None, values are set to 0
+        """
+        import numpy as np
+        from SVDataset import SVDataset3D
+        dataset, model, layers = self.__annotation(i)
+        if not isinstance(dataset, SVDataset3D):
+            raise TypeError('dataset %d stores continuous annotations' % i)
+        temp_idx = _numeric_array(temp_idx, 'temp_idx')
+        durations = _numeric_array(durations, 'durations')
+        if values is None:
+            values = np.zeros(len(temp_idx))
+        else:
+            values = _numeric_array(values, 'values')
+        dataset.set_data_from_iterable(_frames(temp_idx, self.samplerate), values, _frames(durations, self.samplerate), labels)
+        if len(temp_idx) > 0:
+            for atname, atval in zip(['start', 'end'], dataset.extent(0)):
+                if model.hasAttribute(atname):
+                    model.setAttribute(atname, str(atval))
+
+    def __annotation(self, i):
+        """
+        Dataset of rank i, with its model and the layers displaying it
+        """
+        datasets = self.__datasets()
+        if not 0 <= i < len(datasets):
+            raise IndexError('environment has %d annotation datasets' % len(datasets))
+        dataset = datasets[i]
+        for model in self.data.childNodes:
+            if model.tagName == 'model' and model.getAttribute('dataset') == dataset.datasetid:
+                break
+        else:
+            raise ValueError('dataset %s has no model' % dataset.datasetid)
+        modelid = model.getAttribute('id')
+        layers = [node for node in self.data.childNodes
+                  if node.tagName == 'layer' and node.getAttribute('model') == modelid]
+        return dataset, model, layers
+
+    def save(self, outfname, nworkers=1, compresslevel=9, incremental=False, cache=None):
         """
         Save the environment of a sv file to be used with soniv visualiser
         
         Args:
           outfname(str): full path to the file storing the environment
+
+        Kwargs:
+          nworkers(int): number of compression processes. If different
+            from 1, the bzip2 blocks of the file are compressed in
+            parallel, and merged into a single bzip2 stream. None uses
+            all the cpus
+          compresslevel(int): bzip2 compression level, between 1 and 9
+          incremental(bool): the blocks of each dataset are compressed
+            independently, kept in memory and reused by the next saves
+            until the dataset is modified. The file remains a single
+            bzip2 stream. nworkers is ignored
+          cache(BuildCache or str): build cache, or path to its directory.
+            If an environment of same content was saved with the same
+            compression level, the cached file is linked (or copied) to
+            outfname. Else the saved file is added to the cache
         """
-        f = BZ2File(outfname, 'w')
+        if exists(outfname):
+            # lazy datasets read from the file to be overwritten
+            for ds in self.__datasets():
+                if ds._source is not None and samefile(ds._source.reader.fname, outfname):
+                    ds.load()
+        if cache is not None:
+            from SVBuildCache import BuildCache
+            if isinstance(cache, basestring):
+                cache = BuildCache(cache)
+            key = cache.key(self, compresslevel)
+            if cache.fetch(key, outfname):
+                return
+        if exists(outfname) and os.stat(outfname).st_nlink > 1:
+            # may be linked to a cached file, which must not be modified
+            os.remove(outfname)
+        if incremental:
+            f = SplicingBZ2Writer(outfname, compresslevel)
+        elif nworkers == 1:
+            f = BZ2File(outfname, 'w', compresslevel=compresslevel)
+        else:
+            f = ParallelBZ2Writer(outfname, nworkers, compresslevel)
         self.doc.writexml(f, addindent='  ', newl='\n')
         f.close()     
+        if cache is not None:
+            cache.store(key, outfname)
 
 
 
+    def __datasets(self):
+        from SVDataset import SVDataset2D
+        return [node for node in self.data.childNodes if isinstance(node, SVDataset2D)]
+
+    def __clone(self):
+        """
+        Copy of the environment, whose datasets are empty
+        """
+        ret = copy.copy(self)
+        ret.__dname = dict(self.__dname)
+        ret.doc = doc = SVDocument(self.doc.documentElement.tagName, self.doc.doctype)
+
+        def clone(node, parent):
+            if isinstance(node, SVElement):
+                copy = SVElement(node.tagName, doc)
+                copy.attributes = node.attributes.copy()
+                for child in node.childNodes:
+                    clone(child, copy)
+            else:
+                # copies of the datasets are empty
+                copy = node.cloneNode(False)
+                copy.ownerDocument = doc
+            copy.parentNode = parent
+            parent.childNodes.append(copy)
+            return copy
+
+        for node in self.doc.documentElement.childNodes:
+            node = clone(node, doc.documentElement)
+            if node.tagName in ('data', 'display', 'selections'):
+                setattr(ret, node.tagName, node)
+        return ret
+
     def __namefact(self, name):
         if name not in self.__dname:
             self.__dname[name] = 0
@@ -429,6 +972,7 @@ class SVEnv:
         return layer
 
 if __name__ == '__main__':
+    import numpy as np
     # SVEnv.parse('/home/david/test.sv')
 
     #import sys
@@ -0,0 +1,416 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 David Doukhan <david.doukhan@gmail.com>
+
+# This file is part of py_sonicvisualiser.
+
+# py_sonicvisualiser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# py_sonicvisualiser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with TimeSide.  If not, see <http://www.gnu.org/licenses/>.
+
+# Author: David Doukhan <david.doukhan@gmail.com>
+
+
+"""
+Streaming generation of sonic visualiser environment files
+
+SVEnvWriter serializes the points of annotation layers as they are
+produced by iterators of numpy chunks. The points are compressed as they
+arrive in a temporary spool file, as single block bzip2 streams. The
+models and display sections are written on close, and the compressed
+blocks are merged into the single bzip2 stream of the output file
+without being decompressed.
+"""
+
+import bz2
+import collections
+import gc
+import os
+import tempfile
+from SVEnv import SVEnv, _numeric_array, _frames
+from SVBz2 import SplicingBZ2Writer, block_input_size
+
+
+def _import_node(node, doc, deep=False):
+    """
+    Copy of an element owned by doc, so that the copy does not keep
+    the document of node alive
+    """
+    ret = node.cloneNode(deep)
+    for copy in [ret] + (ret.getElementsByTagName('*') if deep else []):
+        copy.ownerDocument = doc
+    return ret
+
+
+def _iter_annotation_layers(sve, i):
+    """
+    Yield the annotation layers of the environment of rank i as
+    (key, dataset, model, layer, viewkey) tuples. key identifies the layer
+    by type, model name and rank, viewkey identifies its view
+    """
+    datasets = dict((node.datasetid, node) for node in sve.data.childNodes
+                    if getattr(node, 'tagName', None) == 'dataset')
+    layers = dict((node.getAttribute('model'), node) for node in reversed(sve.data.getElementsByTagName('layer')))
+    views = dict((ref.getAttribute('id'), (i, iview)) for iview, view in enumerate(sve.display.getElementsByTagName('view'))
+                 for ref in view.getElementsByTagName('layer'))
+    ranks = collections.defaultdict(int)
+    for model in sve.data.getElementsByTagName('model'):
+        dataset = datasets.get(model.getAttribute('dataset'))
+        layer = layers.get(model.getAttribute('id'))
+        if dataset is None or layer is None:
+            continue
+        name = (layer.getAttribute('type'), model.getAttribute('name'))
+        ranks[name] += 1
+        yield name + (ranks[name],), dataset, model, layer, views.get(layer.getAttribute('id'), (i, None))
+
+
+class SVSpooledDataset(object):
+    """
+    Dataset node whose points were already serialized and compressed in
+    a spool file, as a sequence of single block bzip2 streams. It may only
+    be written using a SplicingBZ2Writer
+
+    Args:
+      streams(list): (offset, length) of the streams in the spool file
+    """
+    tagName = 'dataset'
+
+    def __init__(self, domdoc, datasetid, dimensions, spool, streams):
+        self.ownerDocument = domdoc
+        self.parentNode = None
+        self.datasetid = datasetid
+        self.dimensions = dimensions
+        self.spool = spool
+        self.streams = streams
+
+    def iter_compressed(self):
+        """
+        Yield the bzip2 streams storing the compressed points
+        """
+        for offset, length in self.streams:
+            self.spool.seek(offset)
+            stream = self.spool.read(length)
+            if len(stream) != length:
+                raise IOError('truncated spool file')
+            yield stream
+
+    def writexml(self, writer, indent="", addindent="", newl=""):
+        writer.write('%s<dataset id="%s" dimensions="%s">%s' % (indent, self.datasetid, self.dimensions, newl))
+        writer.splice(self.iter_compressed())
+        writer.write('%s</dataset>%s' % (indent, newl))
+
+
+class SVEnvWriter(SVEnv):
+    """
+    Sonic visualiser environment written to outfname on close, whose
+    annotation layers may be added from iterators of numpy chunks.
+    Only one chunk of each streamed layer is kept in memory.
+
+    Layers added using the methods of SVEnv are kept in memory until close.
+
+    SVEnvWriter may be used as a context manager:
+
+    >>> with SVEnvWriter.init_from_wave_file('out.sv', 'audio.wav') as sve:
+    ...     sve.add_continuous_stream((x, y) for x, y in features())
+    """
+
+    # indentation of the point nodes, written at depth 3 by save
+    _pointindent = 3 * '  '
+
+    def __init__(self, outfname, samplerate, nframes, wavpath, compresslevel=9, tmpdir=None):
+        """
+        Args:
+          outfname(str): full path to the file storing the environment
+          samplerate(int): media sample rate (Hz)
+          nframes(int): number of samples
+          wavpath(str): Full path to the wav file used in the current environment
+
+        Kwargs:
+          compresslevel(int): bzip2 compression level, between 1 and 9
+          tmpdir(str): directory of the spool file, default to the
+            system temporary directory
+        """
+        SVEnv.__init__(self, samplerate, nframes, wavpath)
+        self.outfname = outfname
+        self.compresslevel = compresslevel
+        self.spool = tempfile.TemporaryFile(dir=tmpdir)
+
+    @staticmethod
+    def init_from_wave_file(outfname, wavpath, cache=None, **kwargs):
+        """
+        Init a streaming environment based on the analysis of the main
+        audio file, see SVEnv.init_from_wave_file
+
+        Args:
+          outfname(str): full path to the file storing the environment
+          wavpath(str): the full path to the wavfile
+
+        Kwargs:
+          cache(ProbeCache or str): persistent cache of the probing results
+          other keyword arguments are passed to the constructor
+        """
+        sve = SVEnv.init_from_wave_file(wavpath, cache)
+        return SVEnvWriter(outfname, sve.samplerate, sve.nframes, wavpath, **kwargs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.spool.close()
+
+    def __spool(self, datasets):
+        """
+        Serialize the points of a sequence of datasets, and compress them
+        at the end of the spool file as single block bzip2 streams
+
+        Returns:
+          list of (offset, length) of the streams in the spool file
+        """
+        self.spool.seek(0, 2)
+        size = block_input_size(self.compresslevel)
+        streams = []
+        buf = ''
+
+        def spool(data):
+            stream = bz2.compress(data, self.compresslevel)
+            streams.append((self.spool.tell(), len(stream)))
+            self.spool.write(stream)
+
+        for dataset in datasets:
+            for chunk in dataset._iter_xml_points(self._pointindent, '\n'):
+                buf += chunk
+                while len(buf) >= size:
+                    spool(buf[:size])
+                    buf = buf[size:]
+        if buf:
+            spool(buf)
+        return streams
+
+    def add_continuous_stream(self, chunks, colourName='Purple', colour='#c832ff', name='', view=None, vscale=None, presentationName=None):
+        """
+        add a continous annotation layer whose points are read from
+        a sequence of chunks, see add_continuous_annotations
+
+        Args:
+          chunks (iterable): (x, y) pairs of float arrays, x being
+            temporal indices and y values
+
+        Returns:
+          <DOM Element: view>: the view used to store the layer
+        """
+        import numpy as np
+        from SVDataset import SVDataset2D
+        # xmin, xmax, ymin, ymax
+        bounds = [np.inf, -np.inf, np.inf, -np.inf]
+
+        def datasets():
+            for x, y in chunks:
+                x = _numeric_array(x, 'x')
+                y = _numeric_array(y, 'y')
+                if len(x) == 0:
+                    continue
+                dataset = SVDataset2D(self.doc, None, self.samplerate)
+                dataset.set_data_from_iterable(_frames(x, self.samplerate), y)
+                bounds[:] = [min(bounds[0], x.min()), max(bounds[1], x.max()),
+                             min(bounds[2], y.min()), max(bounds[3], y.max())]
+                yield dataset
+
+        streams = self.__spool(datasets())
+        xmin, xmax, ymin, ymax = bounds
+        if xmin > xmax:
+            raise ValueError('empty continuous annotation stream')
+        dataset = SVSpooledDataset(self.doc, None, 2, self.spool, streams)
+        return self._add_continuous_dataset(dataset, int(xmin * self.samplerate), int(xmax * self.samplerate), ymin, ymax,
+                                            colourName, colour, name, view, vscale, presentationName)
+
+    def add_interval_stream(self, chunks, colourName='Purple', colour='#c832ff', name='', view=None, presentationName=None):
+        """
+        add a labelled interval annotation layer whose points are read
+        from a sequence of chunks, see add_interval_annotations
+
+        Args:
+          chunks (iterable): (temp_idx, durations, labels) or
+            (temp_idx, durations, labels, values) tuples of arrays
+
+        Returns:
+          <DOM Element: view>: the view used to store the layer
+        """
+        import numpy as np
+        from SVDataset import SVDataset3D
+
+        def datasets():
+            for chunk in chunks:
+                temp_idx, durations, labels = chunk[:3]
+                temp_idx = _numeric_array(temp_idx, 'temp_idx')
+                durations = _numeric_array(durations, 'durations')
+                values = np.zeros(len(temp_idx)) if len(chunk) < 4 else _numeric_array(chunk[3], 'values')
+                dataset = SVDataset3D(self.doc, None, self.samplerate)
+                dataset.set_data_from_iterable(_frames(temp_idx, self.samplerate), values,
+                                               _frames(durations, self.samplerate), labels)
+                yield dataset
+
+        streams = self.__spool(datasets())
+        dataset = SVSpooledDataset(self.doc, None, 3, self.spool, streams)
+        return self._add_interval_dataset(dataset, colourName, colour, name, view, presentationName)
+
+    @staticmethod
+    def concatenate(outfname, svenvfnames, wavpath, compresslevel=9, tmpdir=None):
+        """
+        Join the environments of consecutive audio chunks into the
+        environment of the concatenated audio file
+
+        The annotation layers of the inputs are matched by layer type,
+        model name and order of appearance. The points of each input are
+        shifted by the number of frames of the previous chunks and spooled
+        in compressed form, so a single input is held in memory at a time.
+        Models and layers of the output are copies of those of the first
+        input containing the layer, with new ids. The views of the first
+        input are copied with all their layers, such as spectrograms;
+        layers missing from the first input are displayed as in the first
+        input containing them.
+
+        Args:
+          outfname(str): full path to the joined environment file
+          svenvfnames(str sequence): full paths to the environments of the
+            chunks, in temporal order, sharing the same sample rate
+          wavpath(str): full path to the concatenated audio file
+
+        Kwargs:
+          compresslevel(int): bzip2 compression level, between 1 and 9
+          tmpdir(str): directory of the spool file
+        """
+        writer = None
+        offset = 0
+        # joined layers indexed by (layer type, model name, rank)
+        layers = collections.OrderedDict()
+        # views of the first input, and its layers displaying the audio
+        views = []
+        audiolayers = []
+        for i, svenvfname in enumerate(svenvfnames):
+            sve = SVEnv.parse(svenvfname, lazy=True)
+            if writer is None:
+                writer = SVEnvWriter(outfname, sve.samplerate, 0, wavpath, compresslevel, tmpdir)
+            elif sve.samplerate != writer.samplerate:
+                raise ValueError('%s: sample rate %d differs from %d' % (svenvfname, sve.samplerate, writer.samplerate))
+            if i == 0:
+                mainids = [node.getAttribute('id') for node in sve.data.getElementsByTagName('model')
+                           if node.getAttribute('mainModel') == 'true']
+                audiolayers = [_import_node(node, writer.doc) for node in sve.data.getElementsByTagName('layer')
+                               if node.getAttribute('model') in mainids]
+                views = [_import_node(node, writer.doc, True) for node in sve.display.getElementsByTagName('view')]
+            for key, dataset, model, layer, viewkey in _iter_annotation_layers(sve, i):
+                if key not in layers:
+                    layers[key] = {'model': _import_node(model, writer.doc), 'layer': _import_node(layer, writer.doc), 'viewkey': viewkey,
+                                   'dimensions': dataset.dimensions, 'streams': [], 'extent': {}}
+                joined = layers[key]
+                if dataset.dimensions != joined['dimensions']:
+                    raise ValueError('%s: dataset %s dimensions differ from the first input' % (svenvfname, dataset.datasetid))
+                dataset.shift(offset)
+                joined['streams'].extend(writer.__spool([dataset]))
+                dataset.clear()
+                # (value, attribute) pairs, the extrema of the values
+                # keeping their original representation
+                extent = joined['extent']
+                for atname, func, shift in [('start', min, offset), ('end', max, offset),
+                                            ('minimum', min, 0), ('maximum', max, 0)]:
+                    if model.hasAttribute(atname):
+                        text = model.getAttribute(atname)
+                        val = float(text) + shift
+                        if shift:
+                            text = str(int(val))
+                        if atname not in extent or func(extent[atname][0], val) != extent[atname][0]:
+                            extent[atname] = (val, text)
+            offset += sve.nframes
+            # the nodes of the input form reference cycles, released
+            # before the next input is parsed
+            sve = dataset = model = layer = None
+            gc.collect()
+        if writer is None:
+            raise ValueError('no environment to concatenate')
+
+        # main model of the concatenated audio
+        writer.nframes = offset
+        for node in writer.data.getElementsByTagName('model'):
+            if node.getAttribute('mainModel') == 'true':
+                node.setAttribute('end', str(offset))
+
+        # the views of the first input replace the default ones
+        for node in writer.display.getElementsByTagName('view'):
+            writer.display.removeChild(node)
+        for node in writer.data.getElementsByTagName('layer'):
+            writer.data.removeChild(node)
+        copies = dict((layer.getAttribute('id'), writer._add_layer_copy(layer, '0')) for layer in audiolayers)
+        newlayers = []
+        for joined in layers.itervalues():
+            dataset = SVSpooledDataset(writer.doc, None, joined['dimensions'], writer.spool, joined['streams'])
+            model = joined['model'].cloneNode(False)
+            for atname, (val, text) in joined['extent'].iteritems():
+                model.setAttribute(atname, text)
+            layer = writer._add_dataset_copy(dataset, model, joined['layer'])
+            # layers scaled to the extrema of the first input follow the
+            # joined ones, as in set_continuous_annotations
+            first = joined['model']
+            if (layer.getAttribute('scaleMinimum'), layer.getAttribute('scaleMaximum')) == (first.getAttribute('minimum'), first.getAttribute('maximum')):
+                for atname, scalename in [('minimum', 'scaleMinimum'), ('maximum', 'scaleMaximum')]:
+                    if atname in joined['extent']:
+                        layer.setAttribute(scalename, joined['extent'][atname][1])
+            viewkey = joined['viewkey']
+            if viewkey[0] == 0:
+                copies[joined['layer'].getAttribute('id')] = layer
+            else:
+                newlayers.append((viewkey, layer))
+        for view in views:
+            writer._add_view_copy(view, copies)
+        newviews = {}
+        for viewkey, layer in newlayers:
+            newviews[viewkey] = writer._add_layer_view(layer, newviews.get(viewkey))
+        writer.close()
+
+    def save(self, outfname, nworkers=1, compresslevel=None, incremental=False, cache=None):
+        """
+        Save the environment, splicing the compressed streamed layers.
+        The arguments are those of SVEnv.save
+
+        Args:
+          outfname(str): full path to the file storing the environment
+
+        Kwargs:
+          nworkers(int): only 1 is supported, the streamed layers being
+            compressed as they are added
+          compresslevel(int): bzip2 compression level of the non streamed
+            content, default to (and at least) the level of the streamed
+            layers
+          incremental(bool): no effect, the compressed datasets are
+            always reused
+          cache: not supported, must be None
+        """
+        if nworkers != 1:
+            raise ValueError('SVEnvWriter does not support parallel compression')
+        if cache is not None:
+            raise ValueError('SVEnvWriter does not support build caches')
+        if os.path.exists(outfname) and os.stat(outfname).st_nlink > 1:
+            # may be linked to a file of a build cache
+            os.remove(outfname)
+        f = SplicingBZ2Writer(outfname, max(compresslevel or 0, self.compresslevel))
+        self.doc.writexml(f, addindent='  ', newl='\n')
+        f.close()
+
+    def close(self):
+        """
+        Write the environment to outfname and release the spool file
+        """
+        if not self.spool.closed:
+            self.save(self.outfname)
+            self.spool.close()
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 David Doukhan <david.doukhan@gmail.com>
+
+# This file is part of py_sonicvisualiser.
+
+# py_sonicvisualiser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# py_sonicvisualiser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with TimeSide.  If not, see <http://www.gnu.org/licenses/>.
+
+# Author: David Doukhan <david.doukhan@gmail.com>
+
+
+"""
+Fast path parser of sonic visualiser environment files built directly on
+pyexpat.
+
+The tree structure is parsed by pyexpat and handled by SVContentHandler,
+while the content of dataset nodes is extracted from the raw text and
+converted to numpy arrays by large chunks: point nodes sharing the same
+layout have their attribute values obtained by a single split on quotes.
+Point nodes not matching this layout, or containing entity references,
+are parsed by pyexpat.
+
+In lazy mode, the content of dataset nodes is not decoded: the location of
+each dataset content in the decompressed stream is recorded, and decoded
+only when the dataset is accessed.
+"""
+
+import collections
+import pyexpat
+import re
+from xml.sax.xmlreader import AttributesImpl
+from SVContentHandler import SVContentHandler
+from SVBz2 import BZ2Reader
+from SVScanner import DatasetScanner, iter_point_bodies
+
+
+_first_key = re.compile(r'\s*<point\s+([^\s=]+)\s*=\s*$')
+_next_key = re.compile(r'\s+([^\s=]+)\s*=\s*$')
+_point_sep = re.compile(r'\s*/>\s*<point\s+([^\s=]+)\s*=\s*$')
+_point_end = re.compile(r'\s*/>\s*$')
+
+
+def _split_points(body):
+    """
+    Extract attribute columns of a sequence of point nodes sharing the same
+    layout, splitting body on quotes.
+    Return None if body does not match this layout
+    """
+    n = body.count('<point')
+    if n == 0:
+        return {} if body.strip() == '' else None
+    tokens = body.split('"')
+    if (len(tokens) - 1) % (2 * n) != 0:
+        return None
+    k = (len(tokens) - 1) // (2 * n)
+    keys = tokens[0:-1:2]
+    values = tokens[1::2]
+    columns = {}
+    for j in xrange(k):
+        following = set(keys[j + k::k])
+        if len(following) > 1:
+            return None
+        m = (_first_key if j == 0 else _next_key).match(keys[j])
+        if m is None:
+            return None
+        if following:
+            m2 = (_point_sep if j == 0 else _next_key).match(following.pop())
+            if m2 is None or m2.group(1) != m.group(1):
+                return None
+        columns[m.group(1)] = values[j::k]
+    if len(columns) != k or _point_end.match(tokens[-1]) is None:
+        return None
+    return columns
+
+
+def _expat_points(body):
+    """
+    Extract attribute columns of a sequence of point nodes using pyexpat
+    """
+    columns = collections.defaultdict(list)
+
+    def start(name, attrs):
+        if name == 'point':
+            for i in xrange(0, len(attrs), 2):
+                columns[attrs[i]].append(attrs[i + 1])
+
+    parser = pyexpat.ParserCreate()
+    parser.ordered_attributes = True
+    parser.returns_unicode = False
+    parser.StartElementHandler = start
+    parser.Parse('<points>%s</points>' % body, True)
+    if len(set([len(v) for v in columns.values()])) > 1:
+        raise ValueError('inconsistent point attributes')
+    return columns
+
+
+def point_columns(body):
+    """
+    Attribute columns of a sequence of point nodes
+
+    Returns:
+      dict: lists of attribute values indexed by attribute name
+    """
+    columns = None
+    if '&' not in body:
+        columns = _split_points(body)
+    if columns is None:
+        columns = _expat_points(body)
+    return columns
+
+
+class SVStreamReader(object):
+    """
+    Access to the decompressed content of a sv file by offset,
+    efficient for increasing offsets
+    """
+    def __init__(self, fname):
+        self.fname = fname
+        self.f = None
+
+    def iter_read(self, offset, length, bufsize=1 << 20):
+        if self.f is None:
+            self.f = BZ2Reader(self.fname)
+        self.f.seek(offset)
+        while length > 0:
+            data = self.f.read(min(bufsize, length))
+            if not data:
+                raise IOError('unexpected end of file %s' % self.fname)
+            length -= len(data)
+            yield data
+
+
+class SVDatasetSource(object):
+    """
+    Location of the content of a dataset node in a sv file
+
+    Args:
+      window((int, int)): if set, only the points in this range of frames
+        are loaded, see SVDataset2D.select_xml_columns
+    """
+    def __init__(self, reader, offset, length, window=None):
+        self.reader = reader
+        self.offset = offset
+        self.length = length
+        self.window = window
+
+    def iter_raw(self):
+        return self.reader.iter_read(self.offset, self.length)
+
+    def load(self, dataset):
+        for body in iter_point_bodies(self.iter_raw()):
+            columns = point_columns(body)
+            if columns and self.window is not None:
+                columns = dataset.select_xml_columns(columns, *self.window)
+            if columns:
+                dataset.append_xml_columns(columns)
+
+
+class SVExpatParser(SVContentHandler):
+    """
+    Build the same structures as SVContentHandler, with a tight code path
+    for the content of dataset nodes
+
+    Args:
+      reader(SVStreamReader): if set, datasets are parsed lazily,
+        their content being read from reader when accessed
+      window((float, float)): if set, time range (seconds) of the points
+        to be kept, see SVContentHandler
+    """
+    def __init__(self, reader=None, window=None):
+        SVContentHandler.__init__(self, window)
+        self.reader = reader
+        self.parser = pyexpat.ParserCreate()
+        self.parser.buffer_text = True
+        self.parser.ordered_attributes = True
+        self.parser.returns_unicode = False
+        self.parser.StartElementHandler = self.expatStartElement
+        self.parser.EndElementHandler = self.endElement
+        self.scanner = DatasetScanner(lambda data: self.parser.Parse(data, False),
+                                      self.startBody, self.addPoints, self.endBody)
+
+    def parse(self, f, bufsize=1 << 20):
+        """
+        Parse a file object containing an uncompressed sonic visualiser environment
+        """
+        while True:
+            data = f.read(bufsize)
+            if not data:
+                break
+            self.feed(data)
+        self.close()
+
+    def feed(self, data):
+        self.scanner.feed(data)
+
+    def close(self):
+        self.scanner.close()
+        self.parser.Parse('', True)
+
+    def startBody(self, tag, offset):
+        # the dataset node was created by the parsing of its start tag
+        self.bodystart = offset
+        return self.reader is None
+
+    def endBody(self, offset):
+        if self.reader is not None:
+            self.datasets[-1].set_source(SVDatasetSource(self.reader, self.bodystart, offset - self.bodystart, self.framewindow))
+
+    def expatStartElement(self, name, attrs):
+        self.startElement(name, AttributesImpl(dict(zip(attrs[::2], attrs[1::2]))))
+
+    def addPoints(self, body):
+        columns = point_columns(body)
+        if columns and self.framewindow is not None:
+            columns = self.datasets[-1].select_xml_columns(columns, *self.framewindow)
+        if columns:
+            self.datasets[-1].append_xml_columns(columns)
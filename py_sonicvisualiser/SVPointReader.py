@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 David Doukhan <david.doukhan@gmail.com>
+
+# This file is part of py_sonicvisualiser.
+
+# py_sonicvisualiser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# py_sonicvisualiser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with TimeSide.  If not, see <http://www.gnu.org/licenses/>.
+
+# Author: David Doukhan <david.doukhan@gmail.com>
+
+
+"""
+Streaming access to the points of sonic visualiser environment files,
+without building the environment structure.
+
+The decompressed file is scanned once for dataset nodes: the content of
+the selected datasets is converted to numpy arrays by large chunks, and
+the rest of the file is skipped.
+"""
+
+import collections
+import re
+from SVBz2 import BZ2Reader
+from SVScanner import DatasetScanner
+
+
+class PointChunk(collections.namedtuple('PointChunk', 'dataset_id frames values durations labels vocabulary')):
+    """
+    Consecutive points of a dataset
+
+    dataset_id(str): id of the dataset node
+    frames(int64 array): frame indices
+    values(float64 array): point values
+    durations(int64 array): durations in frames, None for 2D datasets
+    labels(unsigned int array): label codes, indices of vocabulary
+    vocabulary(list): labels of the dataset found so far, indexed by code
+    """
+    __slots__ = ()
+
+
+_attribute = re.compile(r'([^\s=]+)\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+
+
+def _iter_dataset_content(blocks, selected):
+    """
+    Scan blocks of a decompressed environment for dataset nodes
+
+    Args:
+      blocks(str iterable): decompressed content
+      selected(callable): returns True if the content of a dataset node,
+        given by its attribute dictionnary, should be extracted
+
+    Yields:
+      (attrs, body) pairs, body being a sequence of complete point nodes
+      of the dataset whose attributes are attrs, or None at the end of
+      the dataset node
+    """
+    events = []
+    current = [None]
+
+    def start(tag, offset):
+        current[0] = attrs = dict((m.group(1), m.group(2) if m.group(2) is not None else m.group(3))
+                                  for m in _attribute.finditer(tag, len('<dataset'), len(tag) - 1))
+        return selected(attrs)
+
+    def end(offset):
+        if scanner.keep:
+            events.append((current[0], None))
+
+    scanner = DatasetScanner(start=start, points=lambda body: events.append((current[0], body)), end=end)
+    for block in blocks:
+        scanner.feed(block)
+        for event in events:
+            yield event
+        del events[:]
+    scanner.close()
+
+
+def iter_points(path, dataset_id=None, chunk_size=65536, bufsize=1 << 20):
+    """
+    Stream the points of the datasets of a sonic visualiser environment
+    file, using a constant amount of memory
+
+    Args:
+      path(str): full path to the sonic visualiser environment file
+
+    Kwargs:
+      dataset_id(int, str or iterable): id or ids of the datasets to be
+        read, if set to None all the datasets are read
+      chunk_size(int): maximal number of points per chunk
+      bufsize(int): size of the decompressed blocks read from the file
+
+    Yields:
+      PointChunk: consecutive points of a dataset. The vocabulary of
+        label codes grows between chunks of the same dataset
+    """
+    import numpy as np
+    from SVDataset import SVDataset2D, SVDataset3D
+    from SVExpatParser import point_columns
+    if dataset_id is None:
+        wanted = None
+    elif isinstance(dataset_id, (int, long, basestring)):
+        wanted = set([str(dataset_id)])
+    else:
+        wanted = set(str(i) for i in dataset_id)
+
+    def selected(attrs):
+        return wanted is None or attrs.get('id') in wanted
+
+    f = BZ2Reader(path)
+    try:
+        blocks = iter(lambda: f.read(bufsize), '')
+        current = None
+        for attrs, body in _iter_dataset_content(blocks, selected):
+            if attrs is not current:
+                current = attrs
+                # only used to convert columns and encode labels
+                coder = (SVDataset3D if attrs.get('dimensions') == '3' else SVDataset2D)(None, attrs.get('id'), None)
+                pending = None
+            if body is not None:
+                columns = point_columns(body)
+                if not columns:
+                    continue
+                coder.clear()
+                coder.append_xml_columns(columns)
+                cols = [coder.frames, coder.values, coder.durations if coder.dimensions == 3 else None, coder.labels]
+                if pending is not None:
+                    cols = [None if p is None else np.concatenate((p, c)) for p, c in zip(pending, cols)]
+                n = len(cols[0])
+                start = 0
+                while n - start >= chunk_size:
+                    yield _point_chunk(coder, cols, start, start + chunk_size)
+                    start += chunk_size
+                pending = [None if c is None else c[start:] for c in cols]
+            else:
+                if pending is not None and len(pending[0]) > 0:
+                    yield _point_chunk(coder, pending, 0, len(pending[0]))
+                pending = None
+                if wanted is not None:
+                    wanted.discard(attrs.get('id'))
+                    if not wanted:
+                        # all the requested datasets were read
+                        break
+    finally:
+        f.close()
+
+
+def _point_chunk(coder, cols, start, stop):
+    frames, values, durations, labels = [None if c is None else c[start:stop] for c in cols]
+    vocabulary = [coder.int2label[i] for i in xrange(len(coder.int2label))]
+    return PointChunk(coder.datasetid, frames, values, durations, labels, vocabulary)
@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2013 David Doukhan <david.doukhan@gmail.com>
+
+# This file is part of py_sonicvisualiser.
+
+# py_sonicvisualiser is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 2 of the License, or
+# (at your option) any later version.
+
+# py_sonicvisualiser is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+# You should have received a copy of the GNU General Public License
+# along with TimeSide.  If not, see <http://www.gnu.org/licenses/>.
+
+# Author: David Doukhan <david.doukhan@gmail.com>
+
+
+"""
+Scanning of the dataset nodes of decompressed sonic visualiser
+environments, shared by the expat parser and the point reader.
+
+Dataset bodies are made of point nodes only: they are located by
+searching their tags in the raw text, without parsing it.
+"""
+
+
+def point_boundary(buf, pos):
+    """
+    Offset in buf, not before pos, ending the last complete point node.
+    '<' cannot be found in attribute values: the content is cut before
+    the last point node, which may be incomplete
+    """
+    return max(pos, buf.rfind('<', pos))
+
+
+def iter_point_bodies(blocks):
+    """
+    Regroup blocks of dataset content into sequences of complete point nodes
+    """
+    buf = ''
+    for block in blocks:
+        buf += block
+        cut = point_boundary(buf, 0)
+        if cut > 0:
+            yield buf[:cut]
+            buf = buf[cut:]
+    if buf:
+        yield buf
+
+
+class DatasetScanner(object):
+    """
+    Incremental scanner splitting a decompressed environment into the
+    content outside the dataset bodies, and the bodies of dataset nodes.
+    The handlers are called as the content is fed:
+
+      text(data): content outside the dataset bodies, dataset tags included
+      start(tag, offset): start tag of a dataset node having a body, and
+        offset of the body in the stream. Returns True if the point nodes
+        of the body should be passed to the points handler
+      points(body): sequence of complete point nodes of the current dataset
+      end(offset): offset of the end of the body of the current dataset
+
+    Args:
+      text, start, points, end (callable): handlers, ignored if None
+    """
+    def __init__(self, text=None, start=None, points=None, end=None):
+        self.text = text or (lambda data: None)
+        self.start = start or (lambda tag, offset: False)
+        self.points = points or (lambda body: None)
+        self.end = end or (lambda offset: None)
+        # offset of self.buf in the stream
+        self.offset = 0
+        self.buf = ''
+        self.indataset = False
+        self.keep = False
+
+    def feed(self, data):
+        buf = self.buf + data
+        pos = 0
+        while True:
+            if self.indataset:
+                end = buf.find('</dataset>', pos)
+                if end < 0:
+                    if self.keep:
+                        cut = point_boundary(buf, pos)
+                        if cut > pos:
+                            self.points(buf[pos:cut])
+                    else:
+                        cut = max(pos, len(buf) - len('</dataset>'))
+                    pos = cut
+                    break
+                if self.keep and end > pos:
+                    self.points(buf[pos:end])
+                self.indataset = False
+                self.end(self.offset + end)
+                # the end tag is passed as text
+                pos = end
+            else:
+                start = buf.find('<dataset', pos)
+                if start < 0:
+                    # keep what may be the beginning of a dataset node
+                    cut = max(pos, len(buf) - len('<dataset'))
+                    self.text(buf[pos:cut])
+                    pos = cut
+                    break
+                tagend = buf.find('>', start)
+                if tagend < 0:
+                    self.text(buf[pos:start])
+                    pos = start
+                    break
+                self.text(buf[pos:tagend + 1])
+                pos = tagend + 1
+                if buf[start + len('<dataset')] in ' \t\r\n' and buf[tagend - 1] != '/':
+                    self.indataset = True
+                    self.keep = bool(self.start(buf[start:tagend + 1], self.offset + pos))
+        self.offset += pos
+        self.buf = buf[pos:]
+
+    def close(self):
+        if self.indataset:
+            raise ValueError('unterminated dataset node')
+        self.text(self.buf)
+        self.buf = ''
@@ -4,3 +4,5 @@ __version__ = get_versions()['version']
 del get_versions
 
 from SVEnv import SVEnv
+from SVEnvWriter import SVEnvWriter
+from SVPointReader import iter_points, PointChunk
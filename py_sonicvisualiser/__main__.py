@@ -0,0 +1,4 @@
+import sys
+from py_sonicvisualiser.SVBatch import main
+
+sys.exit(main())